@@ -0,0 +1,94 @@
+"""
+Checks that changelogs are read completely from a server that sends fewer
+entries per page than asked for.
+
+Reads the changelog of every issue of a mock Jira that caps its pages below
+the page size the tool asks for, with no cutoff and with a cutoff some days
+back, and compares the histories with the ones the mock holds. --engine
+async checks the asyncio engine's reader as well, it needs httpx.
+
+    python -m benchmarks.changelog --page-size 50 --changelog 250
+    python -m benchmarks.changelog --engine sync --engine async
+"""
+import argparse
+from datetime import date, timedelta
+import sys
+
+from benchmarks.mock_jira import MockJira, MockJiraData
+from sprint_tool.changelog import ChangelogReader
+from sprint_tool.transport import create_jira_client
+
+
+def expected_histories(issue, since):
+    return [history for history in issue['histories']
+            if since is None or history['created'][:10] > since.isoformat()]
+
+
+def check_reader(reader, data, since, engine=None):
+    """Lists the issues whose histories reader didn't read in full. The
+       histories of an async reader are run on engine"""
+    failures = []
+    for key in data.issue_order:
+        issue = data.issues[key]
+        read = reader.histories(key, issue['fields'].get('updated'))
+        if engine is not None:
+            read = engine.run(read)
+        expected = expected_histories(issue, since)
+        if [history['id'] for history in read] != \
+                [history['id'] for history in expected]:
+            failures.append("%s since %s: read %d of %d entries" % (
+                key, since, len(read), len(expected)))
+    return failures
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check changelog reading against a capped mock Jira')
+    parser.add_argument('--page-size', type=int, default=50,
+                        help='Most changelog entries the mock sends per page')
+    parser.add_argument('--changelog', type=int, default=250,
+                        help='Changelog entries per issue')
+    parser.add_argument('--issues', type=int, default=20,
+                        help='Issues per sprint')
+    parser.add_argument('--days', type=int, default=5,
+                        help='Days back of the cutoff')
+    parser.add_argument('--engine', action='append',
+                        choices=['sync', 'async'],
+                        help='Engine whose reader to check, can be repeated '
+                             '(default: sync)')
+    args = parser.parse_args(argv)
+    engines = args.engine or ['sync']
+
+    data = MockJiraData(issues_per_sprint=args.issues,
+                        changelog_size=args.changelog, closed_sprints=0)
+    server = MockJira(data, max_page_size=args.page_size).start()
+    failures = []
+    engine = None
+    try:
+        jira_instance = create_jira_client(server.url, 'check', 'check')
+        if 'async' in engines:
+            # only needed for async checks, httpx is not a requirement
+            from sprint_tool.async_engine import AsyncEngine
+            engine = AsyncEngine(jira_instance)
+        for since in (None, date.today() - timedelta(days=args.days)):
+            if 'sync' in engines:
+                failures.extend(check_reader(
+                    ChangelogReader(jira_instance, since), data, since))
+            if engine is not None:
+                failures.extend(check_reader(
+                    engine.changelog_reader(since), data, since, engine))
+    finally:
+        if engine is not None:
+            engine.close()
+        server.stop()
+    if failures:
+        print("Failures:")
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
+    print("Read %d changelogs in full from pages of %d" % (
+        2 * len(engines) * len(data.issue_order), args.page_size))
+
+
+if __name__ == '__main__':
+    run()
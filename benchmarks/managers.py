@@ -0,0 +1,142 @@
+"""
+Checks manager lookups against a stand-in LDAP directory, without
+python-ldap or a server.
+
+Looks up the managers of a few hundred users, some of them asked for in
+another case than the directory holds, some with several uids, characters
+that need escaping or no manager, and compares them with the directory's.
+Also checks that the users are searched for in batches, and that a cache
+file spares the next run its searches.
+
+    python -m benchmarks.managers --users 250
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from sprint_tool.managers import LDAP_BATCH_SIZE, ManagerLookup
+
+BASEDN = 'ou=People,dc=example,dc=com'
+
+
+def _unescape(value):
+    return re.sub(r'\\([0-9a-f]{2})', lambda match: chr(int(match.group(1),
+                                                             16)), value)
+
+
+class StandInDirectory(object):
+    """Answers search_s() for (uid=...) filters and OR filters of them from
+       entries, {dn: {attribute: [bytes values]}}, matching uids without
+       regard to case like LDAP does"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.searches = []
+        self.unbound = False
+
+    def search_s(self, base, scope, filterstr, attrlist=None):
+        self.searches.append(filterstr)
+        values = re.findall(r'\(uid=((?:[^()\\]|\\[0-9a-f]{2})*)\)',
+                            filterstr)
+        clauses = "".join("(uid=%s)" % value for value in values)
+        if not values or filterstr not in (clauses, "(|%s)" % clauses):
+            raise ValueError("Bad search filter %s" % filterstr)
+        wanted = set(_unescape(value).lower() for value in values)
+        results = []
+        for dn, attrs in sorted(self.entries.items()):
+            if wanted & set(uid.decode('utf-8').lower()
+                            for uid in attrs['uid']):
+                results.append((dn, {name: attrs[name] for name in attrlist
+                                     if name in attrs}))
+        return results
+
+    def unbind_s(self):
+        self.unbound = True
+
+
+def make_directory(users):
+    """Returns the stand-in's entries and the manager expected for each uid
+       that will be asked for"""
+    entries = {}
+    expected = {}
+    for number in range(users):
+        uid = 'user%d' % number
+        attrs = {'uid': [uid.encode('utf-8')]}
+        manager = None
+        if number % 7:
+            manager = 'boss%d' % (number % 5)
+            attrs['manager'] = [('uid=%s,%s' % (manager, BASEDN))
+                                .encode('utf-8')]
+        entries['uid=%s,%s' % (uid, BASEDN)] = attrs
+        expected[uid] = manager
+    # the directory's case isn't the one Jira asks with
+    entries['uid=JDoe,' + BASEDN] = {
+        'uid': [b'JDoe', b'john.doe'],
+        'manager': [('uid=boss0,' + BASEDN).encode('utf-8')]}
+    expected.update({'jdoe': 'boss0', 'JDOE': 'boss0', 'John.Doe': 'boss0'})
+    entries['uid=odd(one)*,' + BASEDN] = {
+        'uid': [b'odd(one)*'],
+        'manager': [('uid=boss1,' + BASEDN).encode('utf-8')]}
+    expected['odd(one)*'] = 'boss1'
+    expected['nobody'] = None
+    return entries, expected
+
+
+def check_lookup(lookup, expected):
+    """Lists the uids whose manager lookup got wrong"""
+    lookup.prefetch(expected)
+    return ["%s: manager %s, expected %s" % (uid, lookup.manager(uid),
+                                             manager)
+            for uid, manager in sorted(expected.items())
+            if lookup.manager(uid) != manager]
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check manager lookups against a stand-in directory')
+    parser.add_argument('--users', type=int, default=250,
+                        help='Users in the directory')
+    args = parser.parse_args(argv)
+
+    entries, expected = make_directory(args.users)
+    workdir = tempfile.mkdtemp(prefix='sprint-tool-managers-')
+    cache_file = os.path.join(workdir, 'managers.json')
+    failures = []
+    try:
+        directory = StandInDirectory(entries)
+        lookup = ManagerLookup(None, BASEDN, cache_file,
+                               connection=directory)
+        failures.extend(check_lookup(lookup, expected))
+        batches = -(-len(expected) // LDAP_BATCH_SIZE)
+        if len(directory.searches) != batches:
+            failures.append("%d searches for %d users, expected %d" % (
+                len(directory.searches), len(expected), batches))
+        lookup.close()
+        if not directory.unbound:
+            failures.append("connection not unbound")
+
+        directory = StandInDirectory(entries)
+        cached = ManagerLookup(None, BASEDN, cache_file,
+                               connection=directory)
+        failures.extend("cached " + failure
+                        for failure in check_lookup(cached, expected))
+        if directory.searches:
+            failures.append("%d searches with every manager cached" %
+                            len(directory.searches))
+        cached.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failures:
+        print("Failures:")
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
+    print("Looked up the managers of %d users in %d searches" % (
+        len(expected), batches))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,687 @@
+"""
+Local stand-in for the Jira REST and Agile APIs used by sprint-tool.
+
+The server generates synthetic boards, sprints, issues, changelogs and
+worklogs of a chosen size and answers the endpoints the tool calls. Latency,
+the largest page it serves and a rate limit can be set to mimic a real
+server, and every request is counted by endpoint along with the bytes sent
+and received.
+
+    server = MockJira(MockJiraData(issues_per_sprint=300), latency=0.02)
+    server.start()
+    ... point the tool at server.url ...
+    print(server.stats())
+    server.stop()
+
+It can also be run on its own: python -m benchmarks.mock_jira --help
+"""
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.000+0000'
+
+STATUSES = ["To Do", "In Progress", "Blocked", "Done"]
+
+EPIC_LINK_FIELD = 'customfield_10001'
+STORY_POINTS_FIELD = 'customfield_10002'
+
+SYSTEM_FIELDS = ['assignee', 'components', 'created', 'description',
+                 'duedate', 'fixVersions', 'issuetype', 'labels', 'priority',
+                 'progress', 'project', 'reporter', 'status', 'summary',
+                 'timeoriginalestimate', 'timespent', 'updated']
+
+
+def _date(value):
+    return value.strftime(DATE_FORMAT)
+
+
+class MockJiraData(object):
+    """Synthetic Jira contents. Every board has `closed_sprints` closed
+       sprints, one active sprint and `future_sprints` future ones, with
+       issues_per_sprint issues in each of the closed and active sprints"""
+
+    def __init__(self, boards=1, issues_per_sprint=50, closed_sprints=3,
+                 future_sprints=2, changelog_size=10, worklogs_per_issue=3,
+                 users=25, custom_fields=200, sprint_days=14, seed=0):
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.users = [{'key': 'user%d' % number,
+                       'name': 'user%d' % number,
+                       'displayName': 'User %d' % number,
+                       'emailAddress': 'user%d@example.com' % number,
+                       'active': True}
+                      for number in range(users)]
+        self.custom_fields = custom_fields
+        self.sprints = {}
+        self.issues = {}
+        self.issue_order = []
+        self.epics = {}
+        self.next_sprint_id = 1
+        self.next_issue_id = 10000
+        self.changelog_size = changelog_size
+        self.worklogs_per_issue = worklogs_per_issue
+        for board in range(1, boards + 1):
+            self._add_board(board, issues_per_sprint, closed_sprints,
+                            future_sprints, sprint_days)
+        self.epic = self.add_epic('PROJ')
+
+    def user(self):
+        return dict(self.random.choice(self.users))
+
+    def add_sprint(self, board, name, state, start=None, end=None):
+        with self.lock:
+            sprint = {'id': self.next_sprint_id,
+                      'name': name,
+                      'state': state,
+                      'originBoardId': board}
+            if start is not None:
+                sprint['startDate'] = _date(start)
+                sprint['endDate'] = _date(end)
+            self.sprints[sprint['id']] = sprint
+            self.next_sprint_id += 1
+            return sprint
+
+    def _add_board(self, board, issues_per_sprint, closed_sprints,
+                   future_sprints, sprint_days):
+        length = timedelta(days=sprint_days)
+        first_start = self.now - length * (closed_sprints + 1) + \
+            timedelta(days=1)
+        name = "Team %d Sprint" % board
+        for number in range(1, closed_sprints + future_sprints + 2):
+            start = first_start + length * (number - 1)
+            if number <= closed_sprints:
+                state = 'closed'
+            elif number == closed_sprints + 1:
+                state = 'active'
+            else:
+                state = 'future'
+            sprint = self.add_sprint(board, "%s #%d" % (name, number), state,
+                                     start if state != 'future' else None,
+                                     start + length)
+            if state != 'future':
+                for _ in range(issues_per_sprint):
+                    self._add_issue(sprint, start, min(start + length,
+                                                       self.now),
+                                    closed=state == 'closed')
+
+    def _add_issue(self, sprint, start, end, closed):
+        rand = self.random
+        issue_id = self.next_issue_id
+        self.next_issue_id += 1
+        key = 'PROJ-%d' % issue_id
+        created = start + timedelta(seconds=rand.randint(
+            0, int((end - start).total_seconds() * 0.5)))
+        span = max(1, int((end - created).total_seconds()))
+        status = "Done" if closed or rand.random() < 0.4 else \
+            rand.choice(STATUSES[:3])
+        estimate = rand.choice([2, 4, 8, 16]) * 3600
+
+        histories = []
+        moments = sorted(created + timedelta(seconds=rand.randint(0, span))
+                         for _ in range(self.changelog_size))
+        path = ["To Do", "In Progress"] + (["Done"] if status == "Done"
+                                           else [status])
+        for number, moment in enumerate(moments):
+            if number < len(path) - 1:
+                item = {'field': 'status', 'fieldtype': 'jira',
+                        'from': None, 'fromString': path[number],
+                        'to': None, 'toString': path[number + 1]}
+            else:
+                item = {'field': 'description', 'fieldtype': 'jira',
+                        'from': None, 'fromString': 'Old text %d' % number,
+                        'to': None, 'toString': 'New text %d' % number}
+            histories.append({'id': str(issue_id * 100 + number),
+                              'author': self.user(),
+                              'created': _date(moment),
+                              'items': [item]})
+
+        worklogs = []
+        for number in range(self.worklogs_per_issue):
+            moment = created + timedelta(seconds=rand.randint(0, span))
+            worklogs.append({'id': str(issue_id * 100 + number),
+                             'author': self.user(),
+                             'updateAuthor': self.user(),
+                             'comment': 'Worked on %s' % key,
+                             'created': _date(moment),
+                             'updated': _date(moment),
+                             'started': _date(moment),
+                             'timeSpent': '1h',
+                             'timeSpentSeconds': 3600,
+                             'issueId': str(issue_id)})
+
+        updated = max([created] + moments)
+        fields = {
+            'summary': 'Synthetic issue %s' % key,
+            'description': 'Description of %s. ' % key * 5,
+            'status': {'name': status, 'id': str(STATUSES.index(status))},
+            'assignee': self.user(),
+            'reporter': self.user(),
+            'components': [{'id': '1', 'name': 'Component %d' %
+                            rand.randint(1, 5)}],
+            'progress': {'progress': 3600 * self.worklogs_per_issue,
+                         'total': estimate,
+                         'percent': min(100, 100 * 3600 *
+                                        self.worklogs_per_issue // estimate)},
+            'created': _date(created),
+            'updated': _date(updated),
+            'issuetype': {'name': 'Story', 'id': '10001'},
+            'project': {'id': '10000', 'key': 'PROJ'},
+            'priority': {'id': '3', 'name': 'Medium'},
+            'labels': [],
+            'fixVersions': [],
+            'duedate': None,
+            'timeoriginalestimate': estimate,
+            'timespent': 3600 * self.worklogs_per_issue,
+            STORY_POINTS_FIELD: float(rand.choice([1, 2, 3, 5, 8])),
+            EPIC_LINK_FIELD: None,
+        }
+        self.issues[key] = {'id': str(issue_id), 'key': key,
+                            'sprints': [sprint['id']], 'fields': fields,
+                            'histories': histories, 'worklogs': worklogs,
+                            'comments': [], 'watchers': []}
+        self.issue_order.append(key)
+        return self.issues[key]
+
+    def add_epic(self, project):
+        with self.lock:
+            issue_id = self.next_issue_id
+            self.next_issue_id += 1
+            key = '%s-%d' % (project, issue_id)
+            self.epics[key] = True
+            self.issues[key] = {
+                'id': str(issue_id), 'key': key, 'sprints': [],
+                'fields': {'summary': 'Epic to copy',
+                           'description': 'Everyone should do this',
+                           'project': {'id': '10000', 'key': project},
+                           'components': [{'id': '1'}],
+                           'fixVersions': [],
+                           'priority': {'id': '3'},
+                           'reporter': dict(self.users[0]),
+                           'duedate': None,
+                           'issuetype': {'name': 'Epic', 'id': '10000'},
+                           'status': {'name': 'To Do', 'id': '0'},
+                           'updated': _date(self.now),
+                           EPIC_LINK_FIELD: None},
+                'histories': [], 'worklogs': [], 'comments': [],
+                'watchers': []}
+            return key
+
+    def create_issue(self, fields):
+        with self.lock:
+            issue_id = self.next_issue_id
+            self.next_issue_id += 1
+            key = '%s-%d' % (fields.get('project', {}).get('key', 'PROJ'),
+                             issue_id)
+            stored = dict(fields)
+            stored['assignee'] = dict(
+                fields.get('assignee') or {},
+                displayName=(fields.get('assignee') or {}).get('name'))
+            stored.setdefault('status', {'name': 'To Do', 'id': '0'})
+            stored['updated'] = _date(self.now)
+            self.issues[key] = {'id': str(issue_id), 'key': key,
+                                'sprints': [], 'fields': stored,
+                                'histories': [], 'worklogs': [],
+                                'comments': [], 'watchers': []}
+            self.issue_order.append(key)
+            return self.issues[key]
+
+    def fields(self):
+        catalogue = [{'id': field, 'name': field.capitalize(),
+                      'custom': False, 'clauseNames': [field]}
+                     for field in SYSTEM_FIELDS]
+        catalogue.append({'id': EPIC_LINK_FIELD, 'name': 'Epic Link',
+                          'custom': True, 'clauseNames': ['cf[10001]',
+                                                          'Epic Link']})
+        catalogue.append({'id': STORY_POINTS_FIELD, 'name': 'Story Points',
+                          'custom': True, 'clauseNames': ['cf[10002]',
+                                                          'Story Points']})
+        for number in range(self.custom_fields):
+            field = 'customfield_%d' % (20000 + number)
+            catalogue.append({'id': field, 'name': 'Custom field %d' % number,
+                              'custom': True,
+                              'clauseNames': ['cf[%d]' % (20000 + number)],
+                              'schema': {'type': 'string', 'custom':
+                                         'com.atlassian.jira.plugin.system.'
+                                         'customfieldtypes:textfield'}})
+        return catalogue
+
+    def search(self, jql):
+        """The few JQL shapes the tool sends, anything else matches every
+           non-epic issue"""
+        keys = self.issue_order
+        match = re.search(r'key in \(([^)]*)\)', jql)
+        if match:
+            wanted = set(key.strip() for key in match.group(1).split(','))
+            keys = [key for key in keys if key in wanted]
+        match = re.search(r'sprint\s*=\s*(\d+)', jql)
+        if match:
+            sprint_id = int(match.group(1))
+            keys = [key for key in keys
+                    if sprint_id in self.issues[key]['sprints']]
+        if re.search(r'status\s*!=\s*DONE', jql, re.I):
+            keys = [key for key in keys
+                    if self.issues[key]['fields']['status']['name'] != 'Done']
+        match = re.search(r'"Epic Link"\s*=\s*([\w-]+)', jql)
+        if match:
+            keys = [key for key in keys
+                    if self.issues[key]['fields'].get(EPIC_LINK_FIELD) ==
+                    match.group(1)]
+        return [self.issues[key] for key in keys if key not in self.epics]
+
+
+class MockJira(object):
+    """Serves MockJiraData over HTTP on localhost.
+
+       latency: seconds added to every response
+       max_page_size: most results returned by a paginated endpoint
+       rate_limit: requests per second before answering 429, None for none
+    """
+
+    def __init__(self, data=None, latency=0.0, max_page_size=100,
+                 rate_limit=None, port=0):
+        self.data = data or MockJiraData()
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.rate_limit = rate_limit
+        self.port = port
+        self.lock = threading.Lock()
+        self.tokens = rate_limit or 0
+        self.tokens_updated = time.monotonic()
+        self.reset_stats()
+        self.routes = [
+            ('GET', r'/rest/auth/1/session', 'session', self.get_session),
+            ('POST', r'/rest/auth/1/session', 'session', self.get_session),
+            ('GET', r'/rest/api/2/serverInfo', 'serverInfo',
+             self.get_server_info),
+            ('GET', r'/rest/api/2/field', 'field', self.get_fields),
+            ('GET', r'/rest/api/2/search', 'search', self.get_search),
+            ('POST', r'/rest/api/2/search', 'search', self.get_search),
+            ('POST', r'/rest/api/2/issue/bulk', 'issue/bulk',
+             self.post_bulk),
+            ('GET', r'/rest/api/2/user/search', 'user/search',
+             self.get_user_search),
+            ('GET', r'/rest/api/2/issue/(?P<key>[^/]+)/worklog',
+             'issue/worklog', self.get_worklogs),
+            ('GET', r'/rest/api/2/issue/(?P<key>[^/]+)/changelog',
+             'issue/changelog', self.get_changelog),
+            ('POST', r'/rest/api/2/issue/(?P<key>[^/]+)/comment',
+             'issue/comment', self.post_comment),
+            ('POST', r'/rest/api/2/issue/(?P<key>[^/]+)/watchers',
+             'issue/watchers', self.post_watcher),
+            ('GET', r'/rest/api/2/issue/(?P<key>[^/]+)', 'issue',
+             self.get_issue),
+            ('GET', r'/rest/api/2/project/(?P<project>[^/]+)/role',
+             'project/role', self.get_roles),
+            ('GET', r'/rest/api/2/project/(?P<project>[^/]+)/role/(?P<id>\d+)',
+             'project/role/id', self.get_role),
+            ('GET', r'/rest/agile/1.0/board/(?P<board>\d+)/sprint',
+             'board/sprint', self.get_board_sprints),
+            ('POST', r'/rest/agile/1.0/sprint', 'sprint', self.post_sprint),
+            ('GET', r'/rest/agile/1.0/sprint/(?P<id>\d+)', 'sprint/id',
+             self.get_sprint),
+            ('PUT', r'/rest/agile/1.0/sprint/(?P<id>\d+)', 'sprint/id',
+             self.put_sprint),
+            ('POST', r'/rest/agile/1.0/sprint/(?P<id>\d+)', 'sprint/id',
+             self.put_sprint),
+            ('POST', r'/rest/agile/1.0/sprint/(?P<id>\d+)/issue',
+             'sprint/issue', self.post_sprint_issues),
+        ]
+        self.routes = [(method, re.compile(pattern + '$'), name, handler)
+                       for method, pattern, name, handler in self.routes]
+        self.httpd = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+
+    # -- bookkeeping -------------------------------------------------------
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = {}
+            self.throttled = 0
+            self.errors = {}
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def stats(self):
+        with self.lock:
+            return {'requests': sum(self.requests.values()),
+                    'by_endpoint': dict(self.requests),
+                    'throttled': self.throttled,
+                    'errors': sum(self.errors.values()),
+                    'errors_by_endpoint': dict(self.errors),
+                    'bytes_in': self.bytes_in,
+                    'bytes_out': self.bytes_out}
+
+    def _allowed(self):
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens +
+                              (now - self.tokens_updated) * self.rate_limit)
+            self.tokens_updated = now
+            if self.tokens < 1:
+                self.throttled += 1
+                return False
+            self.tokens -= 1
+            return True
+
+    def handle(self, method, path, query, body):
+        """Returns (status, payload, headers) for a request"""
+        for route_method, pattern, name, handler in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                label = '%s %s' % (method, name)
+                with self.lock:
+                    self.requests[label] = self.requests.get(label, 0) + 1
+                if self.latency:
+                    time.sleep(self.latency)
+                if not self._allowed():
+                    return 429, {'errorMessages': ['Rate limit exceeded']}, \
+                        {'Retry-After': '1'}
+                payload = json.loads(body) if body else None
+                response = handler(query, payload, **match.groupdict())
+                if response[0] >= 400:
+                    self._count_error(label)
+                return response
+        self._count_error('%s %s' % (method, path))
+        return 404, {'errorMessages': ['No mock for %s %s' % (method, path)]},\
+            {}
+
+    def _count_error(self, label):
+        # answers a client would see as a failed call, throttling aside
+        with self.lock:
+            self.errors[label] = self.errors.get(label, 0) + 1
+
+    def _page(self, query, items):
+        start = int(query.get('startAt', ['0'])[0])
+        size = min(int(query.get('maxResults', ['50'])[0]),
+                   self.max_page_size)
+        return start, size, items[start:start + size]
+
+    def _base(self):
+        return self.url
+
+    # -- REST API ----------------------------------------------------------
+
+    def get_session(self, query, payload):
+        return 200, {'name': 'bench', 'self': self._base() +
+                     '/rest/api/2/user?username=bench'}, {}
+
+    def get_server_info(self, query, payload):
+        return 200, {'baseUrl': self._base(), 'version': '8.20.0',
+                     'versionNumbers': [8, 20, 0],
+                     'deploymentType': 'Server',
+                     'serverTitle': 'Mock Jira'}, {}
+
+    def get_fields(self, query, payload):
+        return 200, self.data.fields(), {}
+
+    def _issue_json(self, issue, fields=None, expand=''):
+        if not fields or '*all' in fields or 'all' in fields:
+            projected = dict(issue['fields'])
+        else:
+            projected = {field: issue['fields'].get(field)
+                         for field in fields if field in issue['fields']}
+        raw = {'id': issue['id'], 'key': issue['key'],
+               'self': '%s/rest/api/2/issue/%s' % (self._base(), issue['id']),
+               'fields': projected}
+        if 'changelog' in (expand or ''):
+            histories = issue['histories']
+            raw['changelog'] = {'startAt': 0, 'maxResults': len(histories),
+                                'total': len(histories),
+                                'histories': histories}
+        return raw
+
+    def _query_fields(self, query):
+        fields = []
+        for value in query.get('fields', []):
+            fields.extend(field.strip() for field in value.split(',')
+                          if field.strip())
+        return fields
+
+    def get_search(self, query, payload):
+        if payload:
+            query = {key: [value if isinstance(value, str) else
+                           ','.join(value) if isinstance(value, list) else
+                           str(value)]
+                     for key, value in payload.items() if value is not None}
+        with self.data.lock:
+            issues = self.data.search(query.get('jql', [''])[0])
+            start, size, page = self._page(query, issues)
+            fields = self._query_fields(query)
+            expand = query.get('expand', [''])[0]
+            return 200, {'startAt': start, 'maxResults': size,
+                         'total': len(issues),
+                         'issues': [self._issue_json(issue, fields, expand)
+                                    for issue in page]}, {}
+
+    def _find(self, key):
+        issue = self.data.issues.get(key)
+        if issue is None:
+            for candidate in self.data.issues.values():
+                if candidate['id'] == key:
+                    return candidate
+        return issue
+
+    def get_issue(self, query, payload, key):
+        issue = self._find(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist']}, {}
+        return 200, self._issue_json(issue, self._query_fields(query),
+                                     query.get('expand', [''])[0]), {}
+
+    def get_worklogs(self, query, payload, key):
+        issue = self._find(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist']}, {}
+        worklogs = issue['worklogs']
+        return 200, {'startAt': 0, 'maxResults': len(worklogs),
+                     'total': len(worklogs), 'worklogs': worklogs}, {}
+
+    def get_changelog(self, query, payload, key):
+        issue = self._find(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist']}, {}
+        histories = issue['histories']
+        start, size, page = self._page(query, histories)
+        return 200, {'startAt': start, 'maxResults': size,
+                     'total': len(histories),
+                     'isLast': start + size >= len(histories),
+                     'values': page}, {}
+
+    def post_comment(self, query, payload, key):
+        issue = self._find(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist']}, {}
+        with self.data.lock:
+            comment = {'id': str(len(issue['comments']) + 1),
+                       'body': payload['body'],
+                       'author': dict(self.data.users[0])}
+            issue['comments'].append(comment)
+        return 201, comment, {}
+
+    def post_watcher(self, query, payload, key):
+        issue = self._find(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist']}, {}
+        with self.data.lock:
+            issue['watchers'].append(payload)
+        return 204, None, {}
+
+    def post_bulk(self, query, payload):
+        created = []
+        for update in payload['issueUpdates']:
+            issue = self.data.create_issue(update['fields'])
+            created.append({'id': issue['id'], 'key': issue['key'],
+                            'self': '%s/rest/api/2/issue/%s' %
+                            (self._base(), issue['id'])})
+        return 201, {'issues': created, 'errors': []}, {}
+
+    def get_user_search(self, query, payload):
+        term = query.get('username', query.get('query', ['']))[0].lower()
+        users = [dict(user) for user in self.data.users
+                 if term in user['name'].lower() or
+                 term in user['emailAddress'].lower() or
+                 term in user['displayName'].lower()]
+        return 200, self._page(query, users)[2], {}
+
+    def get_roles(self, query, payload, project):
+        return 200, {'Developers': '%s/rest/api/2/project/%s/role/10000' %
+                     (self._base(), project)}, {}
+
+    def get_role(self, query, payload, project, id):
+        return 200, {'self': '%s/rest/api/2/project/%s/role/%s' %
+                     (self._base(), project, id),
+                     'name': 'Developers', 'id': int(id),
+                     'actors': [{'id': number, 'type':
+                                 'atlassian-user-role-actor',
+                                 'name': user['name'],
+                                 'displayName': user['displayName']}
+                                for number, user in
+                                enumerate(self.data.users)]}, {}
+
+    # -- Agile API ---------------------------------------------------------
+
+    def _sprint_json(self, sprint):
+        return dict(sprint, self='%s/rest/agile/1.0/sprint/%d' %
+                    (self._base(), sprint['id']))
+
+    def get_board_sprints(self, query, payload, board):
+        states = query.get('state', [''])[0]
+        states = set(states.split(',')) if states else None
+        with self.data.lock:
+            sprints = [sprint for _, sprint in sorted(self.data.sprints.items())
+                       if sprint['originBoardId'] == int(board) and
+                       (states is None or sprint['state'] in states)]
+        start, size, page = self._page(query, sprints)
+        return 200, {'startAt': start, 'maxResults': size,
+                     'isLast': start + size >= len(sprints),
+                     'values': [self._sprint_json(sprint)
+                                for sprint in page]}, {}
+
+    def get_sprint(self, query, payload, id):
+        sprint = self.data.sprints.get(int(id))
+        if sprint is None:
+            return 404, {'errorMessages': ['Sprint does not exist']}, {}
+        return 200, self._sprint_json(sprint), {}
+
+    def post_sprint(self, query, payload):
+        sprint = self.data.add_sprint(payload['originBoardId'],
+                                      payload['name'], 'future')
+        return 201, self._sprint_json(sprint), {}
+
+    def put_sprint(self, query, payload, id):
+        with self.data.lock:
+            sprint = self.data.sprints.get(int(id))
+            if sprint is None:
+                return 404, {'errorMessages': ['Sprint does not exist']}, {}
+            for key in ('name', 'startDate', 'endDate'):
+                if payload.get(key):
+                    sprint[key] = payload[key]
+            if payload.get('state'):
+                sprint['state'] = payload['state'].lower()
+        return 200, self._sprint_json(sprint), {}
+
+    def post_sprint_issues(self, query, payload, id):
+        if len(payload['issues']) > 50:
+            return 400, {'errorMessages': ['Too many issues']}, {}
+        with self.data.lock:
+            for key in payload['issues']:
+                issue = self._find(key)
+                if issue is not None:
+                    issue['sprints'] = [int(id)]
+        return 204, None, {}
+
+    # -- server ------------------------------------------------------------
+
+    def start(self):
+        self.httpd = _Server(('127.0.0.1', self.port), _Handler)
+        self.httpd.mock = self
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _serve(self):
+        mock = self.server.mock
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, payload, headers = mock.handle(self.command, url.path,
+                                               parse_qs(url.query), body)
+        data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        with mock.lock:
+            mock.bytes_in += len(body) + len(self.path)
+            mock.bytes_out += len(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve a synthetic Jira for trying out sprint-tool')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--boards', type=int, default=1)
+    parser.add_argument('--issues', type=int, default=50,
+                        help='Issues per sprint')
+    parser.add_argument('--changelog', type=int, default=10,
+                        help='Changelog entries per issue')
+    parser.add_argument('--worklogs', type=int, default=3,
+                        help='Worklogs per issue')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='Most results served per page')
+    parser.add_argument('--rate-limit', type=float,
+                        help='Requests per second before answering 429')
+    args = parser.parse_args()
+    data = MockJiraData(boards=args.boards, issues_per_sprint=args.issues,
+                        changelog_size=args.changelog,
+                        worklogs_per_issue=args.worklogs)
+    server = MockJira(data, args.latency, args.page_size, args.rate_limit,
+                      args.port).start()
+    print("Mock Jira on %s, epic %s" % (server.url, data.epic))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
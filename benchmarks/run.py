@@ -0,0 +1,287 @@
+"""
+Runs every sprint-tool command against a local mock Jira and records wall
+time, request count, bytes transferred and peak Python memory.
+
+    python -m benchmarks.run --sizes 50,300 --latency 0.02 \\
+        --save results.json
+    python -m benchmarks.run --sizes 50,300 --latency 0.02 \\
+        --baseline results.json
+
+With --baseline the results are compared to an earlier run, and any
+scenario that got slower or chattier than --threshold allows is flagged
+as a regression and makes the run exit non-zero. So does a scenario with
+failed calls: error responses of the mock, or errors the command printed,
+make its measurements meaningless.
+
+--engine async runs the commands with the asyncio engine instead. Tracing
+memory slows every allocation down, of the mock server too, which runs in
+the same process, until the run is bound by CPU rather than by waiting on
+responses. Compare the engines without it:
+
+    python -m benchmarks.run --sizes 300 --latency 0.1 --no-memory \\
+        --engine sync --engine async
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.mock_jira import MockJira, MockJiraData
+from sprint_tool import main
+from sprint_tool.cache import IssueCache
+from sprint_tool.tables import text_table
+from sprint_tool.transport import create_jira_client
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def active_sprint(data, board=1):
+    return [sprint['id'] for sprint in data.sprints.values()
+            if sprint['state'] == 'active' and
+            sprint['originBoardId'] == board][0]
+
+
+# Each scenario prepares whatever it needs, including warm up runs that are
+# not measured, and returns the call to measure. engine is the AsyncEngine
+# to run the command with, or None for the default engine.
+
+def bench_report(jira_instance, data, workdir, engine):
+    return lambda: main.report(jira_instance, "Team 1 Sprint", 1,
+                               'report.html.j2',
+                               os.path.join(workdir, 'report.html'),
+                               engine=engine)
+
+
+def bench_report_cached(jira_instance, data, workdir, engine):
+    cache = IssueCache(os.path.join(workdir, 'cache.sqlite'))
+
+    def run():
+        main.report(jira_instance, "Team 1 Sprint", 1, 'report.html.j2',
+                    os.path.join(workdir, 'report.html'), cache=cache,
+                    engine=engine)
+
+    run()
+    return run
+
+
+def bench_comment(jira_instance, data, workdir, engine):
+    query = "sprint=%d" % active_sprint(data)
+    return lambda: main.comment_by_query(jira_instance, query,
+                                         "Please update your tickets", False,
+                                         None, None, engine=engine)
+
+
+def bench_copy_epic(jira_instance, data, workdir, engine):
+    return lambda: main.copy_epic_to_task(jira_instance, 'PROJ', data.epic,
+                                          'Developers',
+                                          {'user0': ['user1', 'user2']},
+                                          None, None, None, engine=engine)
+
+
+def bench_roll(jira_instance, data, workdir, engine):
+    return lambda: main.roll_over_sprint(jira_instance, 1, "Team 1 Sprint",
+                                         force=True, engine=engine)
+
+
+SCENARIOS = [
+    ('report', bench_report),
+    ('report-cached', bench_report_cached),
+    ('comment', bench_comment),
+    ('copy-epic', bench_copy_epic),
+    ('roll', bench_roll),
+]
+
+
+def run_scenario(name, scenario, size, args, engine_name='sync'):
+    """Runs one scenario on fresh mock data with the sync or async engine
+       and returns its measurements"""
+    data = MockJiraData(issues_per_sprint=size, users=max(25, size // 10),
+                        changelog_size=args.changelog,
+                        worklogs_per_issue=args.worklogs)
+    server = MockJira(data, latency=args.latency,
+                      max_page_size=args.page_size,
+                      rate_limit=args.rate_limit).start()
+    workdir = tempfile.mkdtemp(prefix='sprint-tool-bench-')
+    shutil.copy(os.path.join(REPO_DIR, 'report.html.j2'), workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    engine = None
+    try:
+        jira_instance = create_jira_client(server.url, 'bench', 'bench')
+        if engine_name == 'async':
+            # only needed for async runs, httpx is not a requirement
+            from sprint_tool.async_engine import AsyncEngine
+            engine = AsyncEngine(jira_instance)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            measured = scenario(jira_instance, data, workdir, engine)
+            server.reset_stats()
+            output.seek(0)
+            output.truncate()
+            if args.memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            measured()
+            elapsed = time.perf_counter() - started
+            peak = 0
+            if args.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        stats = server.stats()
+    finally:
+        if engine is not None:
+            engine.close()
+        os.chdir(cwd)
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'scenario': name, 'engine': engine_name, 'size': size,
+            'seconds': elapsed,
+            'requests': stats['requests'], 'throttled': stats['throttled'],
+            'errors': stats['errors'],
+            'errors_by_endpoint': stats['errors_by_endpoint'],
+            'reported_errors': reported_errors(output.getvalue()),
+            'bytes_in': stats['bytes_in'], 'bytes_out': stats['bytes_out'],
+            'peak_memory': peak, 'by_endpoint': stats['by_endpoint']}
+
+
+def reported_errors(output):
+    """Sums the "Errors: n" counts a command printed"""
+    return sum(int(count)
+               for count in re.findall(r'^Errors: (\d+)$', output, re.M))
+
+
+def find_failures(results):
+    """Lists the results of runs in which calls failed"""
+    failures = []
+    for result in results:
+        if result['errors'] or result['reported_errors']:
+            failures.append("%s/%s/%s: %d error responses %s, %d errors "
+                            "reported" % (
+                                result['scenario'], result['engine'],
+                                result['size'], result['errors'],
+                                result['errors_by_endpoint'],
+                                result['reported_errors']))
+    return failures
+
+
+def find_regressions(results, baseline, threshold):
+    """Lists the results that are more than threshold (a fraction) slower,
+       or make more requests, than the same scenario in baseline"""
+    # results saved before there was an async engine are of the sync one
+    previous = {(result['scenario'], result.get('engine', 'sync'),
+                 result['size']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['engine'],
+                               result['size']))
+        if before is None:
+            continue
+        for metric in ('seconds', 'requests', 'bytes_out', 'peak_memory'):
+            # a run that traced memory is slower than one that didn't, only
+            # compare time and memory of runs that did the same
+            if metric in ('seconds', 'peak_memory') and \
+                    bool(result['peak_memory']) != bool(before['peak_memory']):
+                continue
+            if result[metric] > before[metric] * (1 + threshold):
+                regressions.append("%s/%s/%s: %s went from %s to %s" % (
+                    result['scenario'], result['engine'], result['size'],
+                    metric, _format(metric, before[metric]),
+                    _format(metric, result[metric])))
+    return regressions
+
+
+def _format(metric, value):
+    if metric == 'seconds':
+        return "%.2fs" % value
+    if metric in ('bytes_in', 'bytes_out', 'peak_memory'):
+        return "%.1fMB" % (value / 1024.0 / 1024.0)
+    return str(value)
+
+
+def results_table(results):
+    columns = ('scenario', 'engine', 'size', 'seconds', 'requests',
+               'throttled', 'errors', 'bytes_out', 'peak_memory')
+    rows = [columns] + [tuple(_format(column, result[column])
+                              for column in columns) for result in results]
+    return text_table(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark sprint-tool commands against a mock Jira')
+    parser.add_argument('--sizes', default='50,300',
+                        type=lambda sizes: [int(size)
+                                            for size in sizes.split(',')],
+                        help='Comma separated sprint sizes (issues) to run')
+    parser.add_argument('--scenario', action='append', dest='scenarios',
+                        choices=[name for name, _ in SCENARIOS],
+                        help='Only run this scenario, can be repeated')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Seconds the mock server adds to each response')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='Most results the mock server returns per page')
+    parser.add_argument('--rate-limit', type=float,
+                        help='Requests per second before the mock answers 429')
+    parser.add_argument('--changelog', type=int, default=10,
+                        help='Changelog entries per issue')
+    parser.add_argument('--worklogs', type=int, default=3,
+                        help='Worklogs per issue')
+    parser.add_argument('--engine', action='append', dest='engines',
+                        choices=['sync', 'async'],
+                        help='Engine to run the commands with, can be '
+                             'repeated to compare them (default: sync)')
+    parser.add_argument('--no-memory', action='store_false', dest='memory',
+                        help="Don't trace peak memory, which slows the run "
+                             "down (peak memory is reported as 0)")
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown as a fraction of the baseline')
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    results = []
+    for size in args.sizes:
+        for name, scenario in SCENARIOS:
+            if args.scenarios and name not in args.scenarios:
+                continue
+            for engine_name in args.engines or ['sync']:
+                results.append(run_scenario(name, scenario, size, args,
+                                            engine_name))
+                print(results_table(results[-1:]).splitlines()[-1])
+    print()
+    print(results_table(results))
+    if args.save:
+        with open(args.save, 'w') as file_:
+            json.dump(results, file_, indent=4, sort_keys=True)
+    failures = find_failures(results)
+    if failures:
+        print("\nFailed calls:")
+        for failure in failures:
+            print("  " + failure)
+    if args.baseline:
+        with open(args.baseline) as file_:
+            regressions = find_regressions(results, json.load(file_),
+                                           args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("\nNo regressions against %s" % args.baseline)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,109 @@
+"""
+Guards the start up cost of the sprint-tool command line.
+
+Times `--help` and an argument validation error for every command in fresh
+interpreters, and checks that parsing arguments doesn't import any of the
+heavy dependencies, which must only be imported by the command that uses
+them.
+
+    python -m benchmarks.startup --max-ms 150
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('arrow', 'jinja2', 'jira', 'ldap', 'requests', 'sqlite3',
+                 'urllib3', 'yaml')
+
+COMMANDS = [
+    ['--help'],
+    ['report', '--help'],
+    ['roll', '-s', 'http://jira'],
+    ['report', '-s', 'http://jira'],
+    ['copy-epic', '-s', 'http://jira'],
+    ['comment', '-s', 'http://jira'],
+    ['serve', '-s', 'http://jira'],
+]
+
+# Parses a valid command line and reports which heavy modules got imported.
+IMPORT_CHECK = """
+import json, sys
+from sprint_tool import main
+main.parse_args(%r)
+print(json.dumps(sorted(set(name.split('.')[0] for name in sys.modules)
+                        & set(%r))))
+"""
+
+
+def time_command(argv, runs):
+    """Median wall time in milliseconds of running sprint-tool with argv"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'sprint_tool'] + argv,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def interpreter_ms(runs):
+    """Median start up time of a bare interpreter, subtracted from the
+       timings so the budget only covers sprint-tool itself"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'])
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def heavy_imports(argv):
+    output = subprocess.run([sys.executable, '-c',
+                             IMPORT_CHECK % (argv, HEAVY_MODULES)],
+                            stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8'))
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check the start up time of the sprint-tool command line')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Runs per command, the median is used')
+    parser.add_argument('--max-ms', type=float, default=150,
+                        help="""Most milliseconds a command may take on top of
+                        the interpreter's own start up""")
+    args = parser.parse_args(argv)
+
+    failures = []
+    baseline = interpreter_ms(args.runs)
+    print("interpreter start up: %.1fms" % baseline)
+    for command in COMMANDS:
+        elapsed = time_command(command, args.runs) - baseline
+        print("sprint-tool %-32s +%.1fms" % (' '.join(command), elapsed))
+        if elapsed > args.max_ms:
+            failures.append("%s took %.1fms, over the %.0fms budget" %
+                            (' '.join(command), elapsed, args.max_ms))
+    for command in (['report', '-s', 'x', '-b', '1', '-n', 'Team'],
+                    ['roll', '-s', 'x', '-b', '1', '-n', 'Team'],
+                    ['copy-epic', '-s', 'x', '-j', 'P', '-e', 'P-1',
+                     '--role', 'Developers'],
+                    ['comment', '-s', 'x', '--ticket-comment', 'hi',
+                     '--ticket-comment-query', 'project=P']):
+        imported = heavy_imports(command)
+        if imported:
+            failures.append("parsing %s imported %s" %
+                            (command[0], ', '.join(imported)))
+    if failures:
+        print("\nFailures:")
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
+    print("\nStart up is within budget and imports nothing heavy")
+
+
+if __name__ == '__main__':
+    run()
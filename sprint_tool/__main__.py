@@ -0,0 +1,3 @@
+from sprint_tool.main import run
+
+run()
@@ -0,0 +1,216 @@
+"""
+Sprint history analytics: velocity, carry-over, cycle time and logged
+against estimated hours over a board's closed sprints.
+
+Report records are flattened once into rows of issues, status changes and
+worklogs, and every figure is then worked out with NumPy over those
+columns. NumPy is only needed for this mode, so it is imported when the
+figures are computed and is not a requirement of the tool.
+"""
+from datetime import datetime
+
+from sprint_tool.tables import text_table
+
+# Statuses an issue counts as finished in.
+DONE_STATUSES = ('Done', 'Closed', 'Resolved')
+
+# Statuses an issue hasn't been started in. Cycle time runs from the first
+# change to any other status until the issue is last finished.
+TODO_STATUSES = ('To Do', 'Open', 'Backlog', 'Reopened',
+                 'Selected for Development')
+
+# Name report records carry the original estimate under.
+ESTIMATE_FIELD = 'timeoriginalestimate'
+
+DAY = 24 * 60 * 60
+HOUR = 60 * 60
+
+
+def timestamp(value):
+    """Seconds since the epoch of a Jira ISO 8601 timestamp. The agile API
+       writes UTC as Z, the rest of the API as +0000"""
+    if value.endswith('Z'):
+        value = value[:-1] + '+0000'
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+
+
+def flatten_records(records, points_field):
+    """Rows of the issues, status changes and worklogs of report records.
+       Issue rows are (key, assignee, story points, estimate seconds, done
+       before the first status change, or now if it never changed), status
+       changes are (issue row, timestamp, started, done) and worklogs
+       (issue row, seconds). Issue rows are numbered from 0 in the order of
+       records"""
+    issues = []
+    changes = []
+    worklogs = []
+    for row, record in enumerate(records):
+        fields = record['fields']
+        initial = None
+        for event in record['events']:
+            for change in event['changes']:
+                if change.get('field') != 'status':
+                    continue
+                if initial is None:
+                    initial = change.get('fromString')
+                to_status = change.get('toString')
+                changes.append((row, timestamp(event['event']['created']),
+                                to_status not in TODO_STATUSES,
+                                to_status in DONE_STATUSES))
+        assignee = fields.get('assignee') or {}
+        if initial is None:
+            initial = fields.get('status', {}).get('name')
+        issues.append((record['issue']['key'],
+                       assignee.get('name') or 'Unassigned',
+                       fields.get(points_field) or 0.0,
+                       fields.get(ESTIMATE_FIELD) or 0,
+                       initial in DONE_STATUSES))
+        for worklog in record['worklogs']:
+            worklogs.append((row,
+                             worklog['worklog'].get('timeSpentSeconds', 0)))
+    return issues, changes, worklogs
+
+
+class SprintHistory(object):
+    """Collects the flattened records of closed sprints, see add(), and
+       computes the per sprint and per assignee figures over all of them"""
+
+    def __init__(self):
+        self.sprints = []
+        self.issues = []
+        self.issue_sprints = []
+        self.changes = []
+        self.worklogs = []
+
+    def add(self, sprint, rows):
+        """Adds a sprint, a dict with its name and end timestamp, along with
+           the rows flatten_records() made of its records"""
+        issues, changes, worklogs = rows
+        offset = len(self.issues)
+        self.issue_sprints.extend([len(self.sprints)] * len(issues))
+        self.sprints.append(sprint)
+        self.issues.extend(issues)
+        self.changes.extend((change[0] + offset,) + change[1:]
+                            for change in changes)
+        self.worklogs.extend((row + offset, seconds)
+                             for row, seconds in worklogs)
+
+    def summary(self):
+        """Returns {'sprints': [...], 'assignees': [...]} with a dict of
+           figures for every sprint, in the order they were added, and for
+           every assignee"""
+        import numpy as np
+
+        sprint_count = len(self.sprints)
+        issue_count = len(self.issues)
+        sprint_of = np.array(self.issue_sprints, dtype=np.intp)
+        sprint_end = np.array([sprint['end'] for sprint in self.sprints],
+                              dtype=float)
+        if self.issues:
+            keys, assignees, points, estimates, done_initially = \
+                (np.array(column) for column in zip(*self.issues))
+        else:
+            keys = assignees = np.array([], dtype=str)
+            points = estimates = np.array([], dtype=float)
+            done_initially = np.array([], dtype=bool)
+        points = points.astype(float)
+        estimates = estimates.astype(float)
+        changes = np.array(self.changes, dtype=float).reshape(-1, 4)
+        change_issue = changes[:, 0].astype(np.intp)
+        change_time = changes[:, 1]
+        started = changes[:, 2].astype(bool)
+        finished = changes[:, 3].astype(bool)
+
+        # status of every issue when its sprint ended: the last status change
+        # before the end, or the status it had before its first change
+        order = np.lexsort((change_time, change_issue))
+        before_end = change_time[order] <= sprint_end[sprint_of][
+            change_issue[order]]
+        last_change = np.full(issue_count, -1, dtype=np.intp)
+        np.maximum.at(last_change, change_issue[order][before_end],
+                      np.nonzero(before_end)[0])
+        done_at_end = np.where(last_change >= 0,
+                               finished[order][np.maximum(last_change, 0)],
+                               done_initially)
+
+        # cycle time, from the first change out of a to do status until the
+        # last change to a done status
+        first_start = np.full(issue_count, np.inf)
+        np.minimum.at(first_start, change_issue[started], change_time[started])
+        last_done = np.full(issue_count, -np.inf)
+        np.maximum.at(last_done, change_issue[finished], change_time[finished])
+        cycle_days = np.where(done_at_end & np.isfinite(first_start) &
+                              (last_done >= first_start),
+                              (last_done - first_start) / DAY, np.nan)
+
+        committed = np.bincount(sprint_of, weights=points,
+                                minlength=sprint_count)
+        velocity = np.bincount(sprint_of, weights=points * done_at_end,
+                               minlength=sprint_count)
+        totals = np.bincount(sprint_of, minlength=sprint_count)
+        completed = np.bincount(sprint_of, weights=done_at_end,
+                                minlength=sprint_count)
+        sprints = []
+        for index, sprint in enumerate(self.sprints):
+            cycles = cycle_days[(sprint_of == index) & ~np.isnan(cycle_days)]
+            sprints.append({
+                'sprint': sprint['name'],
+                'issues': int(totals[index]),
+                'committed': float(committed[index]),
+                'velocity': float(velocity[index]),
+                'carry_over': float(1 - completed[index] / totals[index])
+                if totals[index] else 0.0,
+                'cycle_days_mean': float(cycles.mean()) if cycles.size
+                else None,
+                'cycle_days_median': float(np.median(cycles)) if cycles.size
+                else None})
+
+        # issues carried over are in several sprints, count each one once
+        _, first_rows = np.unique(keys, return_index=True)
+        unique = np.zeros(issue_count, dtype=bool)
+        unique[first_rows] = True
+        names, assignee_index = np.unique(assignees, return_inverse=True)
+        worklogs = np.array(self.worklogs, dtype=float).reshape(-1, 2)
+        worklog_issue = worklogs[:, 0].astype(np.intp)
+        counted = unique[worklog_issue]
+        estimated = np.bincount(assignee_index[unique],
+                                weights=estimates[unique],
+                                minlength=len(names)) / HOUR
+        logged = np.bincount(assignee_index[worklog_issue[counted]],
+                             weights=worklogs[:, 1][counted],
+                             minlength=len(names)) / HOUR
+        issues = np.bincount(assignee_index[unique], minlength=len(names))
+        assignee_figures = [{
+            'assignee': str(name),
+            'issues': int(issues[index]),
+            'estimated_hours': float(estimated[index]),
+            'logged_hours': float(logged[index]),
+            'logged_ratio': float(logged[index] / estimated[index])
+            if estimated[index] else None}
+            for index, name in enumerate(names)]
+        return {'sprints': sprints, 'assignees': assignee_figures}
+
+
+def _number(value, pattern="%.1f"):
+    return "-" if value is None else pattern % value
+
+
+def summary_tables(summary):
+    """Formats summary() as plain text tables"""
+    sprints = [("Sprint", "Issues", "Committed", "Velocity", "Carry-over",
+                "Cycle days (mean)", "Cycle days (median)")]
+    for sprint in summary['sprints']:
+        sprints.append((sprint['sprint'], str(sprint['issues']),
+                        _number(sprint['committed']),
+                        _number(sprint['velocity']),
+                        _number(sprint['carry_over'] * 100, "%.0f%%"),
+                        _number(sprint['cycle_days_mean']),
+                        _number(sprint['cycle_days_median'])))
+    assignees = [("Assignee", "Issues", "Estimated h", "Logged h",
+                  "Logged/estimated")]
+    for assignee in summary['assignees']:
+        assignees.append((assignee['assignee'], str(assignee['issues']),
+                          _number(assignee['estimated_hours']),
+                          _number(assignee['logged_hours']),
+                          _number(assignee['logged_ratio'], "%.2f")))
+    return text_table(sprints) + "\n\n" + text_table(assignees)
@@ -0,0 +1,395 @@
+"""
+Alternative execution backend on asyncio, selected with --engine async.
+
+The read and bulk write calls the commands make by the hundred, searches,
+worklogs, changelogs, comments, sprint listings, bulk creates and watchers,
+are sent from one event loop with many requests in flight on a shared
+connection pool, instead of from a pool of threads. Everything else still
+goes through the synchronous Jira client.
+
+The loop runs in a background thread and the engine's methods block until
+their requests are done, so the commands call them like any other function
+and produce the same output as with the default engine. httpx is only needed
+for this engine, so it is imported when the engine is created and is not a
+requirement of the tool.
+"""
+import asyncio
+from collections import deque
+import json
+import random
+import threading
+import time
+
+from sprint_tool import profiling
+from sprint_tool.bulk import (DEFAULT_RETRIES, RETRY_STATUSES, BulkRunner,
+                              _retry_after)
+from sprint_tool.changelog import CHANGELOG_PAGE_SIZE, ChangelogReader
+from sprint_tool.sprints import SPRINT_PAGE_SIZE
+from sprint_tool.transport import (DEFAULT_BACKOFF, DEFAULT_HTTP_RETRIES,
+                                   DEFAULT_MAX_CONNECTIONS, DEFAULT_TIMEOUT)
+
+# Search pages requested ahead of the one the caller works on. More pages
+# in flight make the search faster but keep more issues in memory.
+SEARCH_PAGES_AHEAD = 4
+
+
+class AsyncTokenBucket(object):
+    """TokenBucket for coroutines, waits without blocking the loop. Only to
+       be used from the engine's loop"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def call_with_retries(func, args=(), kwargs=None,
+                            retries=DEFAULT_RETRIES, limiter=None,
+                            backoff=1.0, statuses=RETRY_STATUSES):
+    """bulk.call_with_retries() for coroutine functions"""
+    kwargs = kwargs or {}
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as error:
+            status = getattr(error, 'status_code', None)
+            if status not in statuses or attempt >= retries:
+                raise
+            delay = _retry_after(error)
+            if delay is None:
+                delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class AsyncChangelogReader(ChangelogReader):
+    """ChangelogReader whose histories() is a coroutine reading through the
+       engine"""
+
+    def __init__(self, engine, since=None, page_size=CHANGELOG_PAGE_SIZE):
+        super(AsyncChangelogReader, self).__init__(None, since, page_size)
+        self.engine = engine
+
+    async def _page(self, key, start_at, max_results):
+        return await self.engine.get(
+            'issue/{}/changelog'.format(key),
+            params={'startAt': start_at, 'maxResults': max_results})
+
+    async def _inline(self, key):
+        return await self.engine.get(
+            'issue/{}'.format(key),
+            params={'fields': 'updated', 'expand': 'changelog'})
+
+    async def _request(self, key, request):
+        if request is None:
+            return await self._inline(key)
+        return await self._page(key, *request)
+
+    async def histories(self, key, updated=None):
+        """ChangelogReader.histories(), with the same reading"""
+        reads = self._reads(updated)
+        try:
+            request = next(reads)
+            while True:
+                try:
+                    response = await self._request(key, request)
+                except Exception as error:
+                    request = reads.throw(error)
+                else:
+                    request = reads.send(response)
+        except StopIteration as done:
+            return done.value
+
+
+class AsyncBulkRunner(BulkRunner):
+    """BulkRunner for coroutine functions, run on the engine's loop. How
+       many calls are in flight is only limited by the engine's connections
+       and the rate limit"""
+
+    limiter_class = AsyncTokenBucket
+
+    def __init__(self, engine, rate_limit=None, retries=DEFAULT_RETRIES,
+                 checkpoint=None):
+        super(AsyncBulkRunner, self).__init__(None, rate_limit, retries,
+                                              checkpoint)
+        self.engine = engine
+
+    async def _call(self, key, func, args):
+        await call_with_retries(func, args, retries=self.retries,
+                                limiter=self.limiter)
+        if self.checkpoint is not None:
+            self.checkpoint.add(key)
+
+    def run(self, calls):
+        """Runs every (key, coroutine function, args) in calls and waits for
+           them. Keys already in the checkpoint are skipped"""
+        keys = []
+        coroutines = []
+        for key, func, args in calls:
+            if self.checkpoint is not None and key in self.checkpoint:
+                self.skipped += 1
+                continue
+            keys.append(key)
+            coroutines.append(self._call(key, func, args))
+        results = self.engine.run(self.engine.gather(coroutines,
+                                                     return_exceptions=True))
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                self.failed.append((key, result))
+                print("%s - %s" % (key, result))
+            else:
+                self.succeeded += 1
+
+
+class AsyncEngine(object):
+    """Sends requests for the Jira client's server, with its credentials,
+       from an event loop in a background thread. At most max_connections
+       requests are in flight at once. Failed reads are retried like the
+       client's session retries them, writes are retried by the callers"""
+
+    def __init__(self, jira_instance, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_HTTP_RETRIES,
+                 backoff=DEFAULT_BACKOFF):
+        self.jira_instance = jira_instance
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # loop time until which no request is sent, set when throttled
+        self.paused_until = 0.0
+        # times the client logged in again after its session expired
+        self.logins = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name='async-engine')
+        self.thread.daemon = True
+        self.thread.start()
+        self.run(self._open())
+
+    async def _open(self):
+        import httpx
+        session = self.jira_instance._session
+        # asyncio primitives belong to the loop they are made on
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+        self.login_lock = asyncio.Lock()
+        # the client logs in with basic auth, or with a session cookie it
+        # got when it connected
+        auth = session.auth if isinstance(session.auth, tuple) else None
+        self.client = httpx.AsyncClient(
+            auth=auth, cookies=session.cookies, verify=False,
+            timeout=self.timeout,
+            headers={'Accept': 'application/json',
+                     'Content-Type': 'application/json'},
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections))
+        self.transport_error = httpx.TransportError
+
+    def run(self, coroutine):
+        """Runs a coroutine on the engine's loop and returns its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def gather(self, coroutines, return_exceptions=False):
+        return await asyncio.gather(*coroutines,
+                                    return_exceptions=return_exceptions)
+
+    def map(self, func, items):
+        """Calls the coroutine function func on every item at once and
+           returns the results in the same order as items"""
+        return self.run(self.gather([func(item) for item in items]))
+
+    def url(self, path, agile=False):
+        if agile:
+            return self.jira_instance._get_url(
+                path, base=self.jira_instance.AGILE_BASE_URL)
+        return self.jira_instance._get_url(path)
+
+    async def _pause(self):
+        # with many requests in flight, one that is throttled means the rest
+        # will be too, so hold them all back and spread them out again
+        while self.paused_until > self.loop.time():
+            await asyncio.sleep(self.paused_until - self.loop.time() +
+                                random.uniform(0, self.backoff))
+
+    async def _login(self, logins):
+        """Logs the client in again like its cookie auth does on a 401,
+           unless another request did since logins"""
+        session = self.jira_instance._session
+        async with self.login_lock:
+            if self.logins != logins:
+                return
+            # the client's session is blocking, keep it off the loop
+            await self.loop.run_in_executor(None, session.auth.init_session)
+            self.client.cookies = session.cookies
+            self.logins += 1
+
+    async def _send(self, method, url, params=None, payload=None,
+                    login=True):
+        from jira.exceptions import JIRAError
+        data = None if payload is None else json.dumps(payload)
+        logins = self.logins
+        await self._pause()
+        async with self.semaphore:
+            await self._pause()
+            with profiling.call(profiling.endpoint_name(method, url)):
+                try:
+                    response = await self.client.request(
+                        method, url, params=params, content=data)
+                except self.transport_error as error:
+                    raise JIRAError(str(error), url=url)
+        if response.status_code == 429:
+            error = JIRAError(response.text, status_code=429,
+                              url=str(response.url), response=response)
+            self.paused_until = max(self.paused_until, self.loop.time() +
+                                    (_retry_after(error) or self.backoff))
+            raise error
+        # the session cookie expired, log in again and retry once
+        if response.status_code == 401 and login and \
+                hasattr(self.jira_instance._session.auth, 'init_session'):
+            await self._login(logins)
+            return await self._send(method, url, params, payload, False)
+        if response.status_code >= 400:
+            raise JIRAError(response.text, status_code=response.status_code,
+                            url=str(response.url), response=response)
+        return response.json() if response.content else None
+
+    async def get(self, path, params=None, agile=False):
+        """JSON of a GET request. Throttled and failed requests, and ones
+           whose connection failed (no status), are retried with backoff"""
+        return await call_with_retries(
+            self._send, ('GET', self.url(path, agile), params),
+            retries=self.retries, backoff=self.backoff,
+            statuses=RETRY_STATUSES + (None,))
+
+    async def post(self, path, payload):
+        """JSON of a POST request, not retried"""
+        return await self._send('POST', self.url(path), payload=payload)
+
+    async def _search_page(self, params, start_at):
+        with profiling.span('search'):
+            return await self.get('search', dict(params, startAt=start_at))
+
+    def iter_issue_pages(self, jql, fields=None, expand=None, page_size=100):
+        """Same as main.iter_issue_pages(). Once the first page gives the
+           total, the next SEARCH_PAGES_AHEAD pages are requested at once"""
+        params = {'jql': jql,
+                  'maxResults': page_size,
+                  'fields': ','.join(fields) if fields else '*all'}
+        if expand:
+            params['expand'] = expand
+        page = self.run(self._search_page(params, 0))
+        if not page['issues']:
+            return
+        # the server may send fewer issues per page than asked for
+        step = len(page['issues'])
+        starts = deque(range(step, page['total'], step))
+        pending = deque()
+        try:
+            yield page['issues']
+            while starts or pending:
+                while starts and len(pending) < SEARCH_PAGES_AHEAD:
+                    pending.append(asyncio.run_coroutine_threadsafe(
+                        self._search_page(params, starts.popleft()),
+                        self.loop))
+                issues = pending.popleft().result()['issues']
+                if not issues:
+                    break
+                yield issues
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _list_sprints(self, board_id, page_size):
+        sprints = []
+        while True:
+            page = await self.get(
+                'board/{}/sprint'.format(board_id),
+                params={'startAt': len(sprints), 'maxResults': page_size},
+                agile=True)
+            sprints.extend(page['values'])
+            if page.get('isLast', True) or not page['values']:
+                return sprints
+
+    def list_sprints(self, board_id, page_size=SPRINT_PAGE_SIZE):
+        """Same as sprints.list_sprints()"""
+        return self.run(self._list_sprints(board_id, page_size))
+
+    def changelog_reader(self, since=None):
+        return AsyncChangelogReader(self, since)
+
+    async def _enrich(self, issue, changelog):
+        worklogs, histories = await asyncio.gather(
+            self.get('issue/{}/worklog'.format(issue['key'])),
+            changelog.histories(issue['key'], issue['fields'].get('updated')))
+        return worklogs['worklogs'], histories
+
+    def enrich(self, issues, changelog):
+        """(worklogs, changelog histories) of every issue, in the order of
+           issues, all fetched at once. changelog is a changelog_reader()"""
+        return self.map(lambda issue: self._enrich(issue, changelog), issues)
+
+    async def add_comment(self, key, body):
+        return await self.post('issue/{}/comment'.format(key),
+                               {'body': body})
+
+    async def add_watcher(self, key, watcher):
+        return await self.post('issue/{}/watchers'.format(key), watcher)
+
+    async def _create_issues(self, field_list):
+        from jira.exceptions import JIRAError
+        payload = {'issueUpdates': [{'fields': fields}
+                                    for fields in field_list]}
+        try:
+            raw = await self.post('issue/bulk', payload)
+        except JIRAError as error:
+            # none of the issues was created, the errors say why
+            if error.status_code != 400 or error.response is None:
+                raise
+            raw = error.response.json()
+        errors = {error['failedElementNumber']:
+                  error['elementErrors']['errors']
+                  for error in raw['errors']}
+        created = iter(raw['issues'])
+        return [{'status': 'Error', 'issue': None, 'error': errors[index],
+                 'input_fields': fields} if index in errors else
+                {'status': 'Success', 'issue': next(created), 'error': None,
+                 'input_fields': fields}
+                for index, fields in enumerate(field_list)]
+
+    def create_issues(self, chunks, retries=DEFAULT_RETRIES):
+        """Results of creating every chunk of issue fields with one bulk
+           request each, all sent at once, in the same format as the
+           client's create_issues() except that the issues are raw JSON.
+           Only throttled requests are retried"""
+        results = self.map(
+            lambda chunk: call_with_retries(self._create_issues, (chunk,),
+                                            retries=retries,
+                                            statuses=(429,)),
+            chunks)
+        return [result for chunk_results in results
+                for result in chunk_results]
+
+    def runner(self, rate_limit=None, retries=DEFAULT_RETRIES,
+               checkpoint=None):
+        return AsyncBulkRunner(self, rate_limit, retries, checkpoint)
+
+    def close(self):
+        self.run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
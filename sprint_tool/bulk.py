@@ -0,0 +1,161 @@
+"""
+Helpers for sending many write requests to Jira at once: a worker pool with
+a rate limit, retries on throttling and server errors, and a checkpoint
+file so an interrupted run can be resumed without repeating work.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+import time
+
+DEFAULT_RETRIES = 3
+
+# HTTP statuses worth retrying, anything else is treated as a real failure.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket(object):
+    """Allows on average `rate` calls per second, with bursts of up to
+       `burst` calls. Safe to share between threads"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a call is allowed"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(func, args=(), kwargs=None, retries=DEFAULT_RETRIES,
+                      limiter=None, backoff=1.0, statuses=RETRY_STATUSES):
+    """Calls func, retrying when Jira answers with one of statuses. Waits
+       for the server's Retry-After if given, otherwise backs off
+       exponentially with jitter. limiter is acquired before every attempt"""
+    kwargs = kwargs or {}
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            status = getattr(error, 'status_code', None)
+            if status not in statuses or attempt >= retries:
+                raise
+            delay = _retry_after(error)
+            if delay is None:
+                delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            time.sleep(delay)
+            attempt += 1
+
+
+class Checkpoint(object):
+    """Append-only file of the keys that were already handled"""
+
+    def __init__(self, path):
+        self.done = set()
+        try:
+            with open(path) as file_:
+                self.done.update(line.strip() for line in file_
+                                 if line.strip())
+        except FileNotFoundError:
+            pass
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, key):
+        with self.lock:
+            self.done.add(key)
+            self.file.write(key + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BulkRunner(object):
+    """Runs keyed calls on a worker pool, rate limited and retried, and keeps
+       count of what succeeded and failed"""
+
+    limiter_class = TokenBucket
+
+    def __init__(self, workers, rate_limit=None, retries=DEFAULT_RETRIES,
+                 checkpoint=None):
+        self.workers = workers
+        # started with the first calls, runners that don't use threads
+        # never start it
+        self.executor = None
+        self.limiter = self.limiter_class(rate_limit) if rate_limit else None
+        self.retries = retries
+        self.checkpoint = checkpoint
+        self.succeeded = 0
+        self.skipped = 0
+        self.failed = []
+        self.started = time.time()
+
+    def _call(self, key, func, args):
+        call_with_retries(func, args, retries=self.retries,
+                          limiter=self.limiter)
+        if self.checkpoint is not None:
+            self.checkpoint.add(key)
+
+    def run(self, calls):
+        """Runs every (key, func, args) in calls and waits for them. Keys
+           already in the checkpoint are skipped"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max(1, self.workers))
+        futures = []
+        for key, func, args in calls:
+            if self.checkpoint is not None and key in self.checkpoint:
+                self.skipped += 1
+                continue
+            futures.append((key, self.executor.submit(self._call, key, func,
+                                                      args)))
+        for key, future in futures:
+            try:
+                future.result()
+                self.succeeded += 1
+            except Exception as error:
+                self.failed.append((key, error))
+                print("%s - %s" % (key, error))
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        done = self.succeeded + len(self.failed)
+        return ("Successful: %s\nErrors: %s\nSkipped (checkpoint): %s\n"
+                "Elapsed: %.1fs (%.1f requests/s)\n" %
+                (self.succeeded, len(self.failed), self.skipped, elapsed,
+                 done / elapsed if elapsed else 0))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
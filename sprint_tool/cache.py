@@ -0,0 +1,104 @@
+"""
+Local on-disk cache of report records, so repeated runs only download the
+issues that changed since they were last seen.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'sprint-tool')
+
+# Cached issues that have not been refreshed for this long are dropped.
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+
+
+def cache_path(cache_dir, server, name):
+    """Path of a cache file for a given Jira server, so that caches of
+       different servers never mix"""
+    server_hash = hashlib.sha1(server.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, "{}-{}".format(server_hash, name))
+
+
+def remove_expired_files(cache_dir, pattern, ttl=DEFAULT_CACHE_TTL):
+    """Deletes the cache files matching pattern in cache_dir that were not
+       written to for ttl seconds. Every row in them would have expired"""
+    expired = time.time() - ttl
+    for path in glob.glob(os.path.join(cache_dir, pattern)):
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+        except OSError:
+            # gone already, or in use on a system that won't delete it
+            pass
+
+
+class IssueCache(object):
+    """SQLite store of report records keyed by issue key, along with the
+       issue's `updated` timestamp at the time it was cached and the date
+       after which its changelog was read, None for all of it. Can be shared
+       by threads"""
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        # only needed once a command opens the cache, keep it off the
+        # startup path
+        import sqlite3
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.connection.execute(
+            "PRAGMA table_info(issues)")]
+        if columns and 'since' not in columns:
+            # records of older versions don't say which changelog they hold
+            self.connection.execute("DROP TABLE issues")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS issues (
+                key TEXT PRIMARY KEY,
+                updated TEXT,
+                since TEXT,
+                cached_at REAL,
+                record TEXT)""")
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        """Drops every issue that was cached longer than ttl seconds ago"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM issues WHERE cached_at < ?",
+                                    (time.time() - self.ttl,))
+
+    def get(self, keys):
+        """Returns a dict of key: (updated, since, record) for the cached
+           keys"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, updated, since, record FROM issues "
+                "WHERE key IN ({})".format(','.join('?' * len(keys))),
+                keys).fetchall()
+        return {key: (updated, since, json.loads(record))
+                for key, updated, since, record in rows}
+
+    def put(self, records, since=None):
+        """Stores report records whose changelog was read after since, an
+           ISO date, or in full if it is None. Replaces older copies of the
+           same issue"""
+        now = time.time()
+        rows = [(record['issue']['key'], record['fields'].get('updated'),
+                 since, now,
+                 json.dumps(record, default=lambda o: '<not serializable>'))
+                for record in records]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.connection.close()
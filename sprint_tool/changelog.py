@@ -0,0 +1,117 @@
+"""
+Reads issue changelogs from the paginated per-issue changelog endpoint,
+newest entries first, so only the activity since a cutoff date is
+downloaded instead of the whole history of every issue.
+"""
+import threading
+
+# Changelog entries requested per page.
+CHANGELOG_PAGE_SIZE = 100
+
+
+class ChangelogReader(object):
+    """Fetches the changelog histories of issues created after since, a
+       date, or all of them if since is None. Servers without the changelog
+       endpoint answer 404, after which the inline changelog of the issue is
+       used instead, for this and every later issue"""
+
+    def __init__(self, jira_instance, since=None,
+                 page_size=CHANGELOG_PAGE_SIZE):
+        self.jira_instance = jira_instance
+        # Jira timestamps start with the date in their own UTC offset, so the
+        # date part compares as a string
+        self.since = since.isoformat() if since else None
+        self.page_size = page_size
+        self.paged = True
+        self.lock = threading.Lock()
+
+    def _recent(self, histories):
+        if self.since is None:
+            return histories
+        return [history for history in histories
+                if history['created'][:10] > self.since]
+
+    def _page(self, key, start_at, max_results):
+        return self.jira_instance._get_json(
+            'issue/{}/changelog'.format(key),
+            params={'startAt': start_at, 'maxResults': max_results})
+
+    def _inline(self, key):
+        return self.jira_instance._get_json(
+            'issue/{}'.format(key),
+            params={'fields': 'updated', 'expand': 'changelog'})
+
+    def _request(self, key, request):
+        if request is None:
+            return self._inline(key)
+        return self._page(key, *request)
+
+    def _reads(self, updated):
+        """The reading of one changelog, shared by every way of sending the
+           requests. Yields (startAt, maxResults) of the changelog pages to
+           read, or None for the issue with its inline changelog, and takes
+           back their JSON, or has the request's error thrown in. Returns
+           the histories"""
+        if self.since is not None and updated and updated[:10] <= self.since:
+            return []
+        # only needed once a changelog is read, keep it off the startup path
+        from jira.exceptions import JIRAError
+        with self.lock:
+            paged = self.paged
+        if not paged:
+            issue = yield None
+            return self._recent(issue['changelog']['histories'])
+        try:
+            # the first page says how long the changelog is, most are
+            # shorter than a page and are done with this one request
+            first = yield (0, self.page_size)
+        except JIRAError as error:
+            if error.status_code != 404:
+                raise
+            with self.lock:
+                self.paged = False
+            issue = yield None
+            return self._recent(issue['changelog']['histories'])
+        oldest = first['values']
+        # servers may send fewer entries per page than asked for
+        step = min(self.page_size, first.get('maxResults') or self.page_size)
+        if oldest and len(oldest) < first['total']:
+            step = min(step, len(oldest))
+        newer = []
+        # read backwards from the newest entry until one is older than since
+        end = first['total']
+        while end > len(oldest):
+            start_at = max(len(oldest), end - step)
+            # a short page holds the oldest entries of the window, read on
+            # from the last one returned until the window is complete
+            window = []
+            while start_at + len(window) < end:
+                values = (yield (start_at + len(window),
+                                 end - start_at - len(window)))['values']
+                if not values:
+                    return self._recent(window) + newer
+                step = min(step, len(values))
+                window.extend(values)
+            recent = self._recent(window)
+            newer = recent + newer
+            if len(recent) < len(window):
+                return newer
+            end = start_at
+        return self._recent(oldest) + newer
+
+    def histories(self, key, updated=None):
+        """Returns the changelog histories of an issue, oldest first. An
+           issue whose updated timestamp is given and is not after since has
+           nothing to read"""
+        reads = self._reads(updated)
+        try:
+            request = next(reads)
+            while True:
+                try:
+                    response = self._request(key, request)
+                except Exception as error:
+                    request = reads.throw(error)
+                else:
+                    request = reads.send(response)
+        except StopIteration as done:
+            return done.value
@@ -0,0 +1,271 @@
+"""
+Long running service mode. One authenticated, pooled Jira client and the
+caches stay warm between runs, roll-overs and reports run on a schedule
+from a config file, and a small local HTTP API, over TCP or a Unix socket,
+serves reports on demand.
+
+    GET  /health                  jobs and their last runs
+    GET  /report?board=1&sprint=Team%20Sprint[&max_age=60]
+    POST /jobs/<name>/run         runs a scheduled job now
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+# Seconds a report rendered on demand, or by a job, is served from memory.
+DEFAULT_REPORT_MAX_AGE = 300
+
+DEFAULT_LISTEN = '127.0.0.1:8089'
+
+
+class Job(object):
+    """A command run every `every` seconds. options are the job's entry in
+       the config file, handed to the command's handler"""
+
+    def __init__(self, options):
+        self.name = options['name']
+        self.command = options['command']
+        self.every = options['every']
+        self.options = options
+        self.next_run = time.time()
+        self.running = False
+        self.runs = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+
+    def state(self):
+        return {'name': self.name, 'command': self.command,
+                'every': self.every, 'running': self.running,
+                'runs': self.runs, 'last_run': self.last_run,
+                'last_duration': self.last_duration,
+                'last_error': self.last_error, 'next_run': self.next_run}
+
+
+class Daemon(object):
+    """Runs the jobs on schedule and answers the HTTP API. handlers maps
+       command names, roll and report, to functions taking a job's options.
+       The report handler also takes the path to write the report to"""
+
+    def __init__(self, handlers, jobs, report_max_age=DEFAULT_REPORT_MAX_AGE):
+        for job in jobs:
+            if job['command'] not in handlers:
+                raise ValueError("Unknown command %s in job %s" % (
+                    job['command'], job['name']))
+        self.handlers = handlers
+        self.jobs = [Job(job) for job in jobs]
+        self.report_max_age = report_max_age
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(jobs)))
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        # (board, sprint name, template): (rendered at, html)
+        self.reports = {}
+        self.report_locks = {}
+        self.workdir = tempfile.mkdtemp(prefix='sprint-tool-')
+        self.started = time.time()
+        self.server = None
+
+    def job(self, name):
+        for job in self.jobs:
+            if job.name == name:
+                return job
+        return None
+
+    def run_job(self, job):
+        """Runs a job unless it is already running, recording how it went"""
+        with self.lock:
+            if job.running:
+                return
+            job.running = True
+        started = time.time()
+        error = None
+        try:
+            if job.command == 'report':
+                output = job.options.get('output', 'report.html')
+                self.handlers['report'](job.options, output)
+                with open(output) as file_:
+                    self._remember_report(job.options, file_.read(),
+                                          started)
+            else:
+                self.handlers[job.command](job.options)
+        except (Exception, SystemExit) as exception:
+            error = "%s: %s" % (type(exception).__name__, exception)
+            print("Job %s failed, %s" % (job.name, error))
+        with self.lock:
+            job.running = False
+            job.runs += 1
+            job.last_run = started
+            job.last_duration = time.time() - started
+            job.last_error = error
+        # a run that came due while this one ran is scheduled now
+        self.wakeup.set()
+
+    def run_now(self, job):
+        with self.lock:
+            job.next_run = time.time()
+        self.wakeup.set()
+
+    def _schedule(self):
+        while not self.stopping.is_set():
+            now = time.time()
+            with self.lock:
+                due = [job for job in self.jobs
+                       if job.next_run <= now and not job.running]
+                for job in due:
+                    job.next_run = now + job.every
+            for job in due:
+                self.executor.submit(self.run_job, job)
+            # running jobs wake the scheduler when they finish, until then
+            # a run of theirs that is due can't start
+            with self.lock:
+                next_run = min([job.next_run for job in self.jobs
+                                if not job.running] or [now + 3600])
+            self.wakeup.wait(max(0.0, next_run - time.time()))
+            self.wakeup.clear()
+
+    def _report_key(self, options):
+        return (str(options['board']), options['sprint_name'],
+                options.get('template', 'report.html.j2'))
+
+    def _remember_report(self, options, html, rendered_at):
+        with self.lock:
+            self.reports[self._report_key(options)] = (rendered_at, html)
+
+    def report(self, options, max_age=None):
+        """HTML of a report, rendered now unless one rendered less than
+           max_age seconds ago is in memory. Requests for a report that is
+           being rendered wait for it instead of rendering it again"""
+        max_age = self.report_max_age if max_age is None else max_age
+        key = self._report_key(options)
+        with self.lock:
+            lock = self.report_locks.setdefault(key, threading.Lock())
+        with lock:
+            with self.lock:
+                rendered_at, html = self.reports.get(key, (0, None))
+            if html is not None and rendered_at >= time.time() - max_age:
+                return html
+            started = time.time()
+            directory = tempfile.mkdtemp(dir=self.workdir)
+            try:
+                output = os.path.join(directory, 'report.html')
+                self.handlers['report'](options, output)
+                with open(output) as file_:
+                    html = file_.read()
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            self._remember_report(options, html, started)
+            return html
+
+    def health(self):
+        with self.lock:
+            return {'status': 'ok', 'uptime': time.time() - self.started,
+                    'jobs': [job.state() for job in self.jobs]}
+
+    def serve(self, listen=DEFAULT_LISTEN, socket_path=None):
+        """Starts the scheduler and answers API requests until stopped"""
+        if socket_path:
+            self.server = UnixHTTPServer(socket_path, APIHandler)
+            where = socket_path
+        else:
+            host, port = listen.rsplit(':', 1)
+            self.server = ThreadingHTTPServer((host, int(port)), APIHandler)
+            where = "http://%s:%d" % self.server.server_address[:2]
+        self.server.service = self
+        scheduler = threading.Thread(target=self._schedule,
+                                     name='scheduler')
+        scheduler.daemon = True
+        scheduler.start()
+        print("Serving on %s with %d jobs" % (where, len(self.jobs)))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.server is not None:
+            self.server.server_close()
+            if isinstance(self.server, UnixHTTPServer):
+                os.remove(self.server.server_address)
+        self.executor.shutdown(wait=True)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # a socket left behind by a daemon that was killed can be reused
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    """The HTTP API, see the module docstring"""
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def _send(self, status, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body, indent=4, sort_keys=True)
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values
+                 in parse_qs(url.query).items()}
+        if url.path == '/health':
+            self._send(200, service.health())
+        elif url.path == '/report':
+            if 'board' not in query or 'sprint' not in query:
+                self._send(400, {'error': 'board and sprint are required'})
+                return
+            options = {'board': query['board'],
+                       'sprint_name': query['sprint']}
+            try:
+                max_age = float(query['max_age']) if 'max_age' in query \
+                    else None
+                html = service.report(options, max_age)
+            except (Exception, SystemExit) as exception:
+                self._send(500, {'error': "%s: %s" % (
+                    type(exception).__name__, exception)})
+                return
+            self._send(200, html, 'text/html')
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        service = self.server.service
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'run':
+            job = service.job(parts[1])
+            if job is None:
+                self._send(404, {'error': 'No job called %s' % parts[1]})
+                return
+            service.run_now(job)
+            self._send(202, job.state())
+        else:
+            self._send(404, {'error': 'Not found'})
@@ -0,0 +1,76 @@
+"""
+Index of the Jira field catalogue, so custom field ids can be looked up by
+name without downloading every field definition on each run.
+"""
+import json
+import os
+import threading
+import time
+
+# The field catalogue on disk is trusted for this long.
+DEFAULT_FIELD_TTL = 24 * 60 * 60
+
+
+class FieldRegistry(object):
+    """Maps field names, and ids, to field ids. The catalogue is only
+       fetched when first needed and is kept, in memory and in cache_file,
+       for ttl seconds. A name missing from a cached catalogue fetches it
+       again once, in case the field was created since. A registry that
+       lives longer, like the one of serve, does so again once its own
+       download is ttl seconds old"""
+
+    def __init__(self, jira_instance, cache_file=None, ttl=DEFAULT_FIELD_TTL):
+        self.jira_instance = jira_instance
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.ids = None
+        # when the catalogue was downloaded, and if it was by this registry
+        self.fetched_at = None
+        self.fresh = False
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return None
+        with open(self.cache_file) as file_:
+            cached = json.load(file_)
+        if cached['fetched_at'] < time.time() - self.ttl:
+            return None
+        return cached['fetched_at'], cached['ids']
+
+    def refresh(self):
+        """Downloads the field catalogue and stores it in the cache file"""
+        ids = {}
+        fetched_at = time.time()
+        for field in self.jira_instance.fields():
+            ids[field['id']] = field['id']
+            ids[field['name']] = field['id']
+        if self.cache_file:
+            directory = os.path.dirname(self.cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.cache_file, 'w') as file_:
+                json.dump({'fetched_at': fetched_at, 'ids': ids}, file_)
+        self.ids = ids
+        self.fetched_at = fetched_at
+        self.fresh = True
+
+    def id_for(self, name):
+        """Returns the id of the field called name, e.g. "Epic Link" """
+        with self.lock:
+            if self.ids is None or \
+                    self.fetched_at < time.time() - self.ttl:
+                cached = self._load()
+                if cached is None:
+                    self.refresh()
+                else:
+                    self.fetched_at, self.ids = cached
+                    self.fresh = False
+            if name not in self.ids and not self.fresh:
+                self.refresh()
+            if name not in self.ids:
+                raise LookupError("No field called %s" % name)
+            return self.ids[name]
+
+    def ids_for(self, names):
+        return [self.id_for(name) for name in names]
@@ -1,87 +1,360 @@
-from jira import JIRA
-import jira
 import argparse
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 import ast
 import copy
+import hashlib
 import os
 import sys
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import time
+from sprint_tool.bulk import (DEFAULT_RETRIES, BulkRunner, Checkpoint,
+                              call_with_retries)
+from sprint_tool.cache import (DEFAULT_CACHE_DIR, DEFAULT_CACHE_TTL,
+                               IssueCache, cache_path, remove_expired_files)
+from sprint_tool.changelog import ChangelogReader
+from sprint_tool.fields import DEFAULT_FIELD_TTL, FieldRegistry
+from sprint_tool.managers import ManagerLookup
+from sprint_tool.sprints import (DEFAULT_SPRINT_PATTERN, DEFAULT_SPRINT_TTL,
+                                 SprintIndex, forget_sprint_index,
+                                 list_sprints, load_sprint_index)
+from sprint_tool.output import (EXPORT_FORMATS, JSON_FORMATS,
+                                JSONReportWriter, table_exporter)
+from sprint_tool.tables import text_table
+from sprint_tool import profiling, transport
+
+# Default number of concurrent requests made against the Jira server when
+# fetching per-issue sub-resources such as worklogs.
+DEFAULT_WORKERS = 8
+
+# Number of issues requested per page when searching.
+SEARCH_PAGE_SIZE = 100
+
+# Most issues the server accepts in one bulk create request.
+BULK_CREATE_SIZE = 50
+
+# Most issues the agile API moves to a sprint in one request.
+SPRINT_MOVE_SIZE = 50
+
+# Issue fields used by the report template, everything else is left on the
+# server.
+REPORT_FIELDS = ['assignee', 'components', 'description', 'progress',
+                 'status', 'summary', 'updated']
+
+# Worklog attributes kept in report records.
+WORKLOG_KEYS = ('id', 'comment', 'created', 'updated', 'started',
+                'timeSpent', 'timeSpentSeconds', 'issueId')
+
+# Issues in these statuses get a report row even if they were not updated.
+REPORT_STATUSES = ["In Progress", "Blocked"]
+
+# Only activity after this date is reported, unless JIRA_DATE is set.
+DEFAULT_REPORT_DATE = "2020-02-25T00:00:00.000Z"
+
+# Closed sprints fetched at the same time by report --history.
+HISTORY_WORKERS = 4
 
 def run():
     args = parse_args()
-    print(args)
-    options = {
-        'server': args.jira_server,
-        'agile_rest_path': 'agile',
-        'verify': False
-    }
-    jira_agile_instance = JIRA(options,
-                               auth=(args.jira_user,
-                                     args.jira_password))
-
-    if args.roll_sprints:
-
-        current_sprints = get_current_sprints(jira_agile_instance,
-                                              args.jira_board)
-
-        # Get lists of the current open sprints and the future sprints for this
-        # board.
-
-        future_sprints = get_future_sprints(jira_agile_instance,
-                                            args.jira_board)
-        if len(future_sprints) == 0:
-            raise LookupError("No future sprints found")
-
-        # Get the ids of the sprints we will want to close and start
-        current_sprint_id = find_current_sprint_id(current_sprints,
-                                                   args.sprint_name)
-        next_sprint_id = find_next_sprint_id(future_sprints,
-                                             args.sprint_name)
-
-        new_sprint_name = find_new_sprint_name(future_sprints,
-                                               args.sprint_name)
-
-        issue_keys = get_unfinished_issue_keys(jira_agile_instance,
-                                               args.jira_board,
-                                               current_sprint_id)
-
-        if can_sprint_roll_over(current_sprints[-1]) or args.force:
-
-            create_new_sprint(jira_agile_instance,
-                              args.jira_board,
-                              new_sprint_name)
-            close_current_sprint(jira_agile_instance,
-                                 args.jira_board,
-                                 current_sprint_id)
-            start_next_sprint(jira_agile_instance,
-                              args.jira_board,
-                              next_sprint_id)
-            move_issues_to_next_sprint(jira_agile_instance,
-                                       next_sprint_id,
-                                       issue_keys)
-            
-            print("Yay, the sprint rolled over!!")
+    profiler = None
+    if args.profile or args.profile_trace:
+        profiler = profiling.enable()
+    try:
+        run_command(args)
+    finally:
+        if profiler is not None:
+            print(profiler.summary())
+            if args.profile_trace:
+                profiler.write_trace(args.profile_trace)
+                print("Trace written to %s" % args.profile_trace)
+
+
+def run_command(args):
+    jira_agile_instance = transport.create_jira_client(args.jira_server,
+                                                       args.jira_user,
+                                                       args.jira_password,
+                                                       args.pool_size,
+                                                       args.max_connections,
+                                                       args.timeout,
+                                                       args.http_retries,
+                                                       args.backoff)
+    field_registry = FieldRegistry(
+        jira_agile_instance,
+        None if args.no_cache else cache_path(args.cache_dir,
+                                              args.jira_server,
+                                              'fields.json'),
+        ttl=0 if args.refresh else DEFAULT_FIELD_TTL)
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    engine = None
+    if args.engine == 'async':
+        # only needed for --engine async, keep it off the startup path
+        from sprint_tool.async_engine import AsyncEngine
+        engine = AsyncEngine(jira_agile_instance, args.max_connections,
+                             args.timeout, args.http_retries, args.backoff)
+
+    try:
+        if args.command == 'roll' and args.boards_config:
+            boards = load_boards_config(args.boards_config)
+            results = roll_over_boards(jira_agile_instance, boards,
+                                       args.board_workers, args.force,
+                                       args.workers, args.retries,
+                                       args.sprint_pattern, cache_dir, engine)
+            print(roll_over_table(results))
+            if any(result['error'] for result in results):
+                sys.exit(1)
+        elif args.command == 'roll':
+            roll_over_sprint(jira_agile_instance, args.jira_board,
+                             args.sprint_name, args.force, args.workers,
+                             args.retries, args.sprint_pattern, cache_dir,
+                             engine)
+        elif args.command == 'report':
+            if args.history:
+                cache = open_issue_cache(args, ['history', args.points_field])
+            else:
+                cache = open_issue_cache(args,
+                                         sorted(args.report_fields or []))
+            try:
+                if args.history:
+                    report_history(jira_agile_instance, args.jira_board,
+                                   args.history, args.output, args.workers,
+                                   cache, args.refresh, field_registry,
+                                   args.points_field,
+                                   board_sprints(jira_agile_instance,
+                                                 args.jira_board, args,
+                                                 engine),
+                                   engine)
+                else:
+                    report(jira_agile_instance, args.sprint_name,
+                           args.jira_board, args.template, args.output,
+                           args.workers, cache, args.refresh,
+                           args.json_format, args.gzip, field_registry,
+                           args.report_fields,
+                           None if args.no_cache else
+                           os.path.join(args.cache_dir, 'templates'),
+                           args.export, args.export_format,
+                           board_sprints(jira_agile_instance,
+                                         args.jira_board, args, engine),
+                           engine)
+            finally:
+                if cache is not None:
+                    cache.close()
+        elif args.command == 'copy-epic':
+            copy_epic_to_task(jira_agile_instance, args.project_id,
+                              args.epic_id, args.role, args.watchers,
+                              args.assignees, args.labels, args.prefixes,
+                              args.workers, args.retries, field_registry,
+                              engine)
+        elif args.command == 'comment':
+            manager_cache = None
+            if args.ticket_comment_manager_cc and not args.no_cache:
+                manager_cache = cache_path(args.cache_dir,
+                                           args.ticket_comment_manager_ldap,
+                                           'managers.json')
+            comment_by_query(jira_agile_instance, args.ticket_comment_query,
+                             args.ticket_comment,
+                             args.ticket_comment_manager_cc,
+                             args.ticket_comment_manager_ldap,
+                             args.ticket_comment_manager_ldapbasedn,
+                             manager_cache, args.workers, args.rate_limit,
+                             args.retries, args.checkpoint, engine)
+        elif args.command == 'serve':
+            serve(jira_agile_instance, args, field_registry, engine)
+    finally:
+        if engine is not None:
+            engine.close()
+
+
+def sprint_cache_file(jira_instance, cache_dir, board_id):
+    """Path of the board's cached sprint listing, None without a cache"""
+    if not cache_dir:
+        return None
+    return cache_path(cache_dir, jira_instance.server_url,
+                      'sprints-%s.json' % board_id)
+
+
+def board_sprints(jira_instance, board_id, args, engine=None):
+    """SprintIndex of a board, from the local cache unless --no-cache or
+       --refresh is given"""
+    return load_sprint_index(
+        jira_instance, board_id,
+        sprint_cache_file(jira_instance,
+                          None if args.no_cache else args.cache_dir,
+                          board_id),
+        ttl=0 if args.refresh else DEFAULT_SPRINT_TTL,
+        pattern=args.sprint_pattern, engine=engine)
+
+
+def open_issue_cache(args, cache_key):
+    """Opens the issue cache for records made with the options in
+       cache_key, or returns None with --no-cache. Records hold the extra
+       fields too, so every set of fields gets its own cache. Cache files
+       that expired are deleted first"""
+    if args.no_cache:
+        return None
+    ttl = args.cache_ttl * 24 * 60 * 60
+    remove_expired_files(args.cache_dir, '*-issues-*.sqlite', ttl)
+    cache_name = 'issues-%s.sqlite' % hashlib.sha1(
+        ','.join(cache_key).encode('utf-8')).hexdigest()[:12]
+    return IssueCache(cache_path(args.cache_dir, args.jira_server,
+                                 cache_name), ttl=ttl)
+
+
+def serve(jira_instance, args, field_registry, engine=None):
+    """Runs the jobs of the --config file on schedule and serves reports on
+       demand, all sharing one client, field registry and issue caches"""
+    from sprint_tool.daemon import DEFAULT_REPORT_MAX_AGE, Daemon
+    import signal
+    import threading
+    config = load_config_file(args.config)
+    template_cache = None if args.no_cache else os.path.join(args.cache_dir,
+                                                             'templates')
+    caches = {}
+    caches_lock = threading.Lock()
+
+    def roll_job(options):
+        roll_over_sprint(jira_instance, options['board'],
+                         options['sprint_name'], options.get('force', False),
+                         args.workers, args.retries, args.sprint_pattern,
+                         None if args.no_cache else args.cache_dir, engine)
+
+    def report_job(options, output):
+        report_fields = sorted(options.get('report_fields') or [])
+        with caches_lock:
+            if tuple(report_fields) not in caches:
+                caches[tuple(report_fields)] = open_issue_cache(
+                    args, report_fields)
+            cache = caches[tuple(report_fields)]
+        report(jira_instance, options['sprint_name'], options['board'],
+               options.get('template', 'report.html.j2'), output,
+               args.workers, cache, False,
+               options.get('json_format', 'pretty'), False, field_registry,
+               report_fields, template_cache,
+               sprints=board_sprints(jira_instance, options['board'], args,
+                                     engine),
+               engine=engine)
+
+    daemon = Daemon({'roll': roll_job, 'report': report_job},
+                    config.get('jobs', []),
+                    config.get('report_max_age', DEFAULT_REPORT_MAX_AGE))
+
+    # service managers stop the daemon with SIGTERM, shut down as on Ctrl-C
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        daemon.serve(args.listen, args.socket)
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        for cache in caches.values():
+            if cache is not None:
+                cache.close()
+
+
+def roll_over_sprint(jira_instance, board_id, sprint_name, force=False,
+                     workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES,
+                     sprint_pattern=DEFAULT_SPRINT_PATTERN, cache_dir=None,
+                     engine=None):
+    """Closes the board's current sprint, starts the next one, creates a new
+       future sprint and carries the unfinished issues over. Returns whether
+       the sprint was rolled over. The board's cached sprint listing in
+       cache_dir, if any, is dropped once the sprints changed. With engine,
+       an AsyncEngine, the sprints and issues are listed through it"""
+    # the sprints are always listed afresh, a roll over must not act on a
+    # stale listing
+    with profiling.span('sprints'):
+        sprints = SprintIndex(list_sprints(jira_instance, board_id,
+                                           engine=engine),
+                              sprint_pattern)
+
+    # Get the sprints we will want to close and start
+    current_sprint = sprints.current(sprint_name)
+    print("Current sprint {} (id: {})".format(current_sprint['name'],
+                                              current_sprint['id']))
+    next_sprint = sprints.next(sprint_name)
+    print('Next sprint: {} (id: {})'.format(next_sprint['name'],
+                                            next_sprint['id']))
+
+    new_sprint_name = sprints.new_sprint_name(sprint_name)
+
+    issue_keys = get_unfinished_issue_keys(jira_instance, board_id,
+                                           current_sprint['id'], engine)
+
+    if can_sprint_roll_over(current_sprint) or force:
+
+        create_new_sprint(jira_instance, board_id, new_sprint_name)
+        close_current_sprint(jira_instance, board_id, current_sprint['id'])
+        start_next_sprint(jira_instance, board_id, next_sprint['id'])
+        move_issues_to_next_sprint(jira_instance, next_sprint['id'],
+                                   issue_keys, workers, retries)
+        forget_sprint_index(sprint_cache_file(jira_instance, cache_dir,
+                                              board_id))
+
+        print("Yay, the sprint rolled over!!")
+        return True
+    print("Won't roll over the sprint since it's not the time. You can force it by using --force.")
+    return False
+
+
+def load_config_file(path):
+    """Reads a JSON or YAML config file"""
+    with open(path) as file_:
+        if path.endswith(('.yml', '.yaml')):
+            # only needed for YAML configs, so not a requirement of the tool
+            import yaml
+            return yaml.safe_load(file_)
+        import json
+        return json.load(file_)
+
+
+def load_boards_config(path):
+    """Reads the boards to roll over from a JSON or YAML file holding a list
+       of {"board": <id>, "sprint_name": <prefix>, "force": <bool>}, either
+       on its own or under a "boards" key"""
+    config = load_config_file(path)
+    if isinstance(config, dict):
+        config = config['boards']
+    return config
+
+
+def roll_over_boards(jira_instance, boards, board_workers=DEFAULT_WORKERS,
+                     force=False, workers=DEFAULT_WORKERS,
+                     retries=DEFAULT_RETRIES,
+                     sprint_pattern=DEFAULT_SPRINT_PATTERN, cache_dir=None,
+                     engine=None):
+    """Rolls over the sprints of several boards at once, sharing one client.
+       Returns a result per board, in the order of boards"""
+    def roll(board):
+        started = time.time()
+        result = {'board': board['board'],
+                  'sprint_name': board['sprint_name'],
+                  'rolled': False,
+                  'error': None}
+        try:
+            result['rolled'] = roll_over_sprint(
+                jira_instance, board['board'], board['sprint_name'],
+                force or board.get('force', False), workers, retries,
+                sprint_pattern, cache_dir, engine)
+        except Exception as error:
+            result['error'] = "%s: %s" % (type(error).__name__, error)
+        result['elapsed'] = time.time() - started
+        return result
+
+    return fetch_concurrently(roll, boards, board_workers)
+
+
+def roll_over_table(results):
+    """Formats roll over results as a plain text table"""
+    rows = [("Board", "Sprint", "Result", "Time")]
+    for result in results:
+        if result['error']:
+            outcome = "FAILED " + result['error']
         else:
-            print("Won't roll over the sprint since it's not the time. You can force it by using --force.")
-
-    elif args.report:
-        report(jira_agile_instance, args.sprint_name, args.jira_board,
-                args.template, args.output)
-    elif args.copy_epic_to_task:
-        if not args.project_id or not args.epic_id or not \
-                (args.role or args.assignees):
-            print("To copy an epic you must input project, epic and role")
-            sys.exit()
-        copy_epic_to_task(jira_agile_instance, args.project_id, args.epic_id,
-                          args.role, args.watchers, args.assignees,
-                          args.labels, args.prefixes)
-    elif args.ticket_comment:
-        comment_by_query(jira_agile_instance, args.ticket_comment_query,
-                         args.ticket_comment, args.ticket_comment_manager_cc,
-                         args.ticket_comment_manager_ldap,
-                         args.ticket_comment_manager_ldapbasedn)
+            outcome = "rolled over" if result['rolled'] else "not due"
+        rows.append((str(result['board']), result['sprint_name'], outcome,
+                     "%.2fs" % result['elapsed']))
+    return text_table(rows)
 
 
 def create_new_sprint(jira_instance, board_id, sprint_name):
@@ -90,13 +363,62 @@ def create_new_sprint(jira_instance, board_id, sprint_name):
     jira_instance.create_sprint(sprint_name, board_id)
 
 
-def get_unfinished_issue_keys(jira_instance, board_id, sprint_id):
+def iter_issue_pages(jira_instance, jql, fields=None, expand=None,
+                     page_size=SEARCH_PAGE_SIZE, engine=None):
+    """Yields every page of issues matching jql, as the raw JSON of the
+       issues. The next page is requested in the background while the caller
+       works on the current one. With engine, an AsyncEngine, the pages are
+       searched through it instead"""
+    if engine is not None:
+        for page in engine.iter_issue_pages(jql, fields, expand, page_size):
+            yield page
+        return
+    params = {'jql': jql,
+              'maxResults': page_size,
+              'fields': ','.join(fields) if fields else '*all'}
+    if expand:
+        params['expand'] = expand
+
+    # the REST search is called directly: building resource objects for
+    # every issue costs far more than the callers' work on the raw JSON, and
+    # the client's search_issues() downloads the whole field list first
+    def fetch(start_at):
+        with profiling.span('search'):
+            return jira_instance._get_json('search',
+                                           params=dict(params,
+                                                       startAt=start_at))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = fetch(0)
+        start_at = 0
+        while page['issues']:
+            start_at += len(page['issues'])
+            next_page = None
+            if start_at < page['total']:
+                next_page = executor.submit(fetch, start_at)
+            yield page['issues']
+            if next_page is None:
+                break
+            page = next_page.result()
+
+
+def iter_issues(jira_instance, jql, fields=None, expand=None,
+                page_size=SEARCH_PAGE_SIZE, engine=None):
+    """Yields every issue matching jql, one page in memory at a time"""
+    for page in iter_issue_pages(jira_instance, jql, fields, expand,
+                                 page_size, engine):
+        for issue in page:
+            yield issue
+
+
+def get_unfinished_issue_keys(jira_instance, board_id, sprint_id,
+                              engine=None):
     jql_query = "sprint={sprint_id} AND status != DONE".format(
         sprint_id=sprint_id)
-    unfinished_issues = jira_instance.search_issues(jql_query)
     issue_keys = []
-    for issue in unfinished_issues:
-        issue_keys.append(issue.key)
+    for issue in iter_issues(jira_instance, jql_query, fields=['key'],
+                             engine=engine):
+        issue_keys.append(issue['key'])
     return issue_keys
 
 
@@ -113,41 +435,68 @@ def close_current_sprint(jira_instance, board_id, sprint_id):
 
 
 def comment_by_query(jira_instance, query, comment, cc_to_manager,
-                     ldap_server, basedn):
+                     ldap_server, basedn, manager_cache=None,
+                     workers=DEFAULT_WORKERS, rate_limit=None,
+                     retries=DEFAULT_RETRIES, checkpoint=None, engine=None):
     """Adds a comment to tickets of the specified epic that are in the TODO
-       state. and adds a CC to the users manager"""
+       state. and adds a CC to the users manager. Comments are posted on a
+       worker pool, optionally rate limited to rate_limit per second. Keys of
+       commented issues are written to the checkpoint file, if any, and
+       skipped when the same checkpoint is used again. Every matching issue
+       is listed before the first comment is posted. With engine, an
+       AsyncEngine, the issues are searched and commented through it"""
 
     print("Add Comment to tickets in query results")
 
-    for issue in jira_instance.search_issues(query, maxResults=400):
-        assignee = issue.fields.assignee.key
-        if cc_to_manager:
-            # this is here because it is only required for this part of this
-            # function. So it is not a requirement for the whole script
-            import ldap
-            l = ldap.initialize(ldap_server)
-            l_filter = "uid=%s" % assignee
-            l_attr = ["manager"]
-            l_scope = ldap.SCOPE_SUBTREE
-            ldap_result_id = l.search(basedn, l_scope, l_filter, l_attr)
-            # only expecting a single result per query
-            result_type, result_data = l.result(ldap_result_id, 0)
-            if result_data:
-                manager_dn = result_data[0][1]["manager"][0]
-                manager = ldap.explode_dn(manager_dn)[0].split("=")[1]
-                newcomment = "CC: [~%s]\n\n%s" % \
-                    (manager, comment)
-        else:
+    managers = None
+    if cc_to_manager:
+        managers = ManagerLookup(ldap_server, basedn, manager_cache)
+    checkpoint = Checkpoint(checkpoint) if checkpoint else None
+    if engine is not None:
+        runner = engine.runner(rate_limit, retries, checkpoint)
+        add_comment = engine.add_comment
+    else:
+        runner = BulkRunner(workers, rate_limit, retries, checkpoint)
+        add_comment = jira_instance.add_comment
+    try:
+        # every comment changes the issue's updated timestamp, which would
+        # shift the pages of queries on it under the search, so list every
+        # match before the first comment is posted
+        assignees = {}
+        for issue in iter_issues(jira_instance, query, fields=['assignee'],
+                                 engine=engine):
+            assignees[issue['key']] = \
+                (issue['fields'].get('assignee') or {}).get('key')
+        if managers is not None:
+            with profiling.span('ldap'):
+                managers.prefetch(assignees.values())
+        calls = []
+        for key, assignee in assignees.items():
             newcomment = comment
-        jira_instance.add_comment(issue.key, newcomment)
+            manager = managers.manager(assignee) \
+                if managers is not None and assignee else None
+            if manager:
+                newcomment = "CC: [~%s]\n\n%s" % (manager, comment)
+            calls.append((key, add_comment, (key, newcomment)))
+        with profiling.span('comment'):
+            runner.run(calls)
+    finally:
+        runner.close()
+        if managers is not None:
+            managers.close()
+    print(runner.summary())
 
 
 def copy_epic_to_task(jira_instance, project_id, epic_id, copy_to_role,
-                      watchers, assignees, labels, prefixes):
+                      watchers, assignees, labels, prefixes,
+                      workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES,
+                      field_registry=None, engine=None):
     """copies an epic into tasks assigned to all the users in a specified role
        or to the specified list of assignees. Assignees has higher priority.
        If there are prefixes, unique is prefix + summary, which allows the
-       same assignee multiple tickets. Else, it is one ticket per person"""
+       same assignee multiple tickets. Else, it is one ticket per person.
+       With engine, an AsyncEngine, the existing tasks are searched, and the
+       tasks and watchers added, through it"""
 
     print('Copy epic to tasks')
     print(epic_id)
@@ -182,10 +531,10 @@ def copy_epic_to_task(jira_instance, project_id, epic_id, copy_to_role,
                 sys.exit()
 
     # find custom field names to get epic field
-    custom_map = {fld['name']: fld['id'] for fld in jira_instance.fields()}
+    field_registry = field_registry or FieldRegistry(jira_instance)
     epic = jira_instance.issue(epic_id)
     epic_flds = {"issuetype": {"name": "Task"},
-                 custom_map["Epic Link"]: epic_id,
+                 field_registry.id_for("Epic Link"): epic_id,
                  "project": get_values(epic.fields.project),
                  "summary": epic.fields.summary,
                  "description": epic.fields.description,
@@ -195,28 +544,31 @@ def copy_epic_to_task(jira_instance, project_id, epic_id, copy_to_role,
                  "priority": get_values(epic.fields.priority),
                  "reporter": get_values(epic.fields.reporter, "name"),
                  "duedate": epic.fields.duedate}
-    # gets the list of tasks already assigned to the epic to prevent dups
+    # gets the tasks already assigned to the epic to prevent dups
     # unique is either summary, if prefixes, or assignee
-    # max results defaults to 50, we set 100 as we are currently well below.
-    existing = [issue.fields.summary if prefixes
-                else issue.fields.assignee.name for issue in
-                jira_instance.search_issues(
-                    'project=%s and issueType=Task and "Epic Link"=%s' %
-                    (project_id, epic_id), maxResults=100)]
+    existing = set(issue['fields'].get('summary') if prefixes
+                   else (issue['fields'].get('assignee') or {}).get('name')
+                   for issue in iter_issues(
+                       jira_instance,
+                       'project=%s and issueType=Task and "Epic Link"=%s' %
+                       (project_id, epic_id), fields=['summary', 'assignee'],
+                       engine=engine))
+
+    # index the prefix, label and watcher options by assignee once, instead
+    # of scanning every option for every assignee
+    assignee_prefixes = invert_user_map(prefixes)
+    assignee_labels = invert_user_map(labels)
+    assignee_watchers = invert_user_map(watchers)
+
     task_fields = []
     for assignee in assignees:
-        summary_prefix = [prefix for prefix in prefixes
-                          if prefixes[prefix][0] == assignee]
-        fields = copy.deepcopy(epic_flds.copy())
+        fields = copy.deepcopy(epic_flds)
         fields["assignee"] = {"name": assignee}
-        if labels:
-            for label in labels:
-                if assignee in labels[label]:
-                    fields["labels"].append(label)
+        fields["labels"].extend(assignee_labels.get(assignee, []))
         if prefixes:
             summary = fields["summary"]
-            for prefix in summary_prefix:
-                fields = copy.deepcopy(fields.copy())
+            for prefix in assignee_prefixes.get(assignee, []):
+                fields = copy.deepcopy(fields)
                 fields["summary"] = "[%s] %s" % (prefix, summary)
                 if fields["summary"] not in existing:
                     task_fields.append(fields)
@@ -224,94 +576,88 @@ def copy_epic_to_task(jira_instance, project_id, epic_id, copy_to_role,
             if assignee not in existing:
                 task_fields.append(fields)
 
+    # the server caps how many issues one bulk request may create, so send
+    # chunks of that size in parallel. Only throttled requests are retried,
+    # a retried server error could create the same tasks twice
+    chunks = [task_fields[start:start + BULK_CREATE_SIZE]
+              for start in range(0, len(task_fields), BULK_CREATE_SIZE)]
+    with profiling.span('create'):
+        if engine is not None:
+            results = engine.create_issues(chunks, retries)
+        else:
+            results = [result for chunk_results in fetch_concurrently(
+                           lambda chunk: call_with_retries(
+                               jira_instance.create_issues, (chunk,),
+                               {'prefetch': False}, retries, statuses=(429,)),
+                           chunks, workers)
+                       for result in chunk_results]
+
     success = 0
     error = 0
     existing = len(existing)
-    if task_fields:
-        results = jira_instance.create_issues(task_fields)
-        for result in results:
-            if result["status"] == "Success":
-                success += 1
-                if watchers:
-                    for watcher in watchers:
-                        if result["input_fields"]["assignee"]["name"] \
-                                in watchers[watcher]:
-                            try:
-                                jira_instance.add_watcher(
-                                    result["issue"].key, watcher)
-                            except jira.exceptions.JIRAError:
-                                print ("error adding watcher: %s, %s" %
-                                       (result["issue"].key, watcher))
-            else:
-                error += 1
-                print("%s - %s" % (result["input_fields"]["assignee"]["name"],
-                      result["error"]))
+    if engine is not None:
+        watcher_runner = engine.runner(retries=retries)
+        add_watcher = engine.add_watcher
+    else:
+        watcher_runner = BulkRunner(workers, retries=retries)
+        add_watcher = jira_instance.add_watcher
+    watcher_calls = []
+    for result in results:
+        if result["status"] == "Success":
+            success += 1
+            # the engine's results hold the raw JSON of the issues
+            key = result["issue"]["key"] if engine is not None \
+                else result["issue"].key
+            assignee = result["input_fields"]["assignee"]["name"]
+            for watcher in assignee_watchers.get(assignee, []):
+                watcher_calls.append(("error adding watcher: %s, %s" %
+                                      (key, watcher), add_watcher,
+                                      (key, watcher)))
+        else:
+            error += 1
+            print("%s - %s" % (result["input_fields"]["assignee"]["name"],
+                  result["error"]))
+    try:
+        with profiling.span('watchers'):
+            watcher_runner.run(watcher_calls)
+    finally:
+        watcher_runner.close()
     print("Successful: %s\nErrors: %s\nExisting Tasks: %s\n" %
           (success, error, existing))
 
 
-def find_current_sprint_id(sprints, sprint_name):
-    latest_sprint = None
-
-    for sprint in sprints:
-        # Split the sprint string into name and number then trim whitespace
-        split = [token.strip() for token in sprint.name.split('#')]
-        if sprint_name == split[0]:
-            latest_sprint = sprint
-
-    print("Current sprint {} (id: {})".format(latest_sprint.name, latest_sprint.id))
-    return latest_sprint.id
-
-
-# This should probably have different logic allowing for a different token to
-# split on or just matching numbers at the end of the string,
-# but this works for now.
-def find_new_sprint_name(sprints, sprint_name):
-    sprint_numbers = []
-    for sprint in sprints:
-        # Split the sprint string into name and number then trim whitespace
-        split = [token.strip() for token in sprint.name.split('#')]
-        if sprint_name == split[0]:
-            sprint_numbers.append(split[1])
-    sprint_numbers.sort()
-    next_sprint_number = int(sprint_numbers[-1]) + 1
-    return "{sprint_name} #{sprint_number}".format(
-        sprint_name=sprint_name, sprint_number=next_sprint_number)
-
+def invert_user_map(user_map):
+    """Turns a {"option": ["user1", "user2"]} argument into
+       {"user1": ["option"], "user2": ["option"]}, keeping the option order"""
+    inverted = {}
+    for option in user_map or {}:
+        for user in user_map[option]:
+            inverted.setdefault(user, []).append(option)
+    return inverted
 
-def find_next_sprint_id(sprints, sprint_name):
-    next_sprint = None
-    sprint_number = None
 
-    for sprint in sprints:
-        # Split the sprint string into name and number then trim whitespace
-        split = [token.strip() for token in sprint.name.split('#')]
-        split_sprint_number = int(split[-1])
-        if sprint_name == split[0]:
-            # Find the lowest sprint number in the list and its id
-            if (sprint_number is None) or \
-                    (split_sprint_number < sprint_number):
-                sprint_number = split_sprint_number
-                next_sprint = sprint
-
-    print('Next sprint: {} (id: {})'.format(next_sprint.name, next_sprint.id))
-    return next_sprint.id
-
-
-def get_current_sprints(jira_instance, board_id):
-    sprints = jira_instance.sprints(board_id, state='active')
-    return sprints
-
-
-def get_future_sprints(jira_instance, board_id):
-    sprints = jira_instance.sprints(board_id, state='future')
-    return sprints
+def move_issues_to_next_sprint(
+        jira_agile_instance, next_sprint_id, issue_keys,
+        workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES):
+    """Moves the issues in batches the server accepts, sent in parallel.
+       Moving an issue twice is harmless, so failed batches are retried"""
+    batches = [issue_keys[start:start + SPRINT_MOVE_SIZE]
+               for start in range(0, len(issue_keys), SPRINT_MOVE_SIZE)]
 
+    def move(batch):
+        started = time.time()
+        call_with_retries(jira_agile_instance.add_issues_to_sprint,
+                          (next_sprint_id, batch), retries=retries)
+        return time.time() - started
 
-def move_issues_to_next_sprint(
-        jira_agile_instance, next_sprint_id, issue_keys):
-    jira_agile_instance.add_issues_to_sprint(next_sprint_id,
-                                             issue_keys)
+    started = time.time()
+    with profiling.span('move'):
+        timings = fetch_concurrently(move, batches, workers)
+    for number, (batch, elapsed) in enumerate(zip(batches, timings), 1):
+        print("Moved batch {} of {} ({} issues) in {:.2f}s".format(
+            number, len(batches), len(batch), elapsed))
+    print("Moved {} issues to sprint {} in {:.2f}s".format(
+        len(issue_keys), next_sprint_id, time.time() - started))
 
 
 def start_next_sprint(jira_instance, board_id, sprint_id):
@@ -336,16 +682,16 @@ def flatten(d, parent_key='', sep='_'):
     """
     https://stackoverflow.com/a/6027615
     """
-    import collections
+    from collections.abc import MutableMapping
     items = []
     for k, v in d.items():
         new_key = parent_key + sep + k if parent_key else k
-        if isinstance(v, collections.MutableMapping):
+        if isinstance(v, MutableMapping):
             items.extend(flatten(v, new_key, sep=sep).items())
         elif isinstance(v, list):
             i = 0
             for sk in v:
-                if isinstance(v, collections.MutableMapping):
+                if isinstance(sk, MutableMapping):
                     items.extend(flatten(sk, new_key + sep + str(i) , sep=sep).items())
                 else:
                     items.append((new_key + sep + str(i), sk))
@@ -354,60 +700,329 @@ def flatten(d, parent_key='', sep='_'):
             items.append((new_key, v))
     return dict(items)
 
-def jira2dict(item):
-    data = {}
-    raw = item if isinstance(item, dict) else vars(item)
+def compact_json(raw):
+    """Copy of a raw REST JSON object with only the values the report keeps:
+       no keys with an underscore, which leaves out custom fields, and no
+       empty or numeric values other than integers"""
     good = (str, int, dict, list, bool)
-    for (key,value) in raw.items():
-        if '_' not in key and isinstance(value, good):
-            data[key] = value
-    return data
-
-def report(jira_instance, sprint_name, board, template, output):
-    report = []
-    current_sprints = get_current_sprints(jira_instance, board)
-    sprint_id = find_current_sprint_id(current_sprints, sprint_name)
-    issues = jira_instance.search_issues("sprint={sprint_id}",
-                                         expand="changelog")
-    for issue in issues:
-        issue_data = jira2dict(issue)
-        fields = jira2dict(issue.raw['fields'])
+    return {key: value for key, value in raw.items()
+            if '_' not in key and isinstance(value, good)}
+
+def fetch_concurrently(func, items, workers=DEFAULT_WORKERS):
+    """Calls func on every item using at most `workers` threads and returns
+       the results in the same order as items"""
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def get_worklogs(jira_instance, issue):
+    """Raw JSON of the worklogs of an issue"""
+    return jira_instance._get_json(
+        'issue/{}/worklog'.format(issue['key']))['worklogs']
+
+
+def report_page(jira_instance, issues, workers=DEFAULT_WORKERS,
+                extra_fields=None, changelog=None, engine=None):
+    """Builds the report records for one page of raw issues. extra_fields
+       maps field names to ids of fields added to the record under their
+       name. changelog is the ChangelogReader the histories are read with,
+       by default one reading the whole changelog. With engine, an
+       AsyncEngine, the page is fetched through it and changelog must be
+       one of its changelog readers"""
+    if engine is not None:
+        fetched = engine.enrich(issues,
+                                changelog or engine.changelog_reader())
+    else:
+        changelog = changelog or ChangelogReader(jira_instance)
+
+        def fetch(issue):
+            return (get_worklogs(jira_instance, issue),
+                    changelog.histories(issue['key'],
+                                        issue['fields'].get('updated')))
+
+        # worklogs and changelogs are separate requests per issue, so fetch
+        # the whole page on a thread pool instead of one blocking call at a
+        # time
+        fetched = fetch_concurrently(fetch, issues, workers)
+
+    records = []
+    for issue, (issue_worklog, histories) in zip(issues, fetched):
+        raw_fields = issue['fields']
+        fields = compact_json(raw_fields)
+        for name, field_id in (extra_fields or {}).items():
+            fields[name] = raw_fields.get(field_id)
         events = []
-        for event in issue.changelog.histories:
+        for history in histories:
             events.append({
-                'event': jira2dict(event),
-                'author': jira2dict(event.author),
-                'changes': [jira2dict(item) for item in event.items]
+                'event': {'id': history.get('id'),
+                          'created': history['created']},
+                'author': compact_json(history.get('author') or {}),
+                'changes': [compact_json(item)
+                            for item in history.get('items', [])]
                 })
         worklogs = []
-        for worklog in jira_instance.worklogs(issue):
+        for worklog in issue_worklog:
             worklogs.append({
-                'worklog': jira2dict(worklog),
-                'author': jira2dict(worklog.author)})
-        report.append({
-            'issue': issue_data,
+                'worklog': {key: worklog[key] for key in WORKLOG_KEYS
+                            if worklog.get(key) is not None},
+                'author': compact_json(worklog.get('author') or {})})
+        records.append({
+            'issue': {'id': issue['id'], 'key': issue['key'],
+                      'self': issue['self']},
             'fields': fields,
             'events': events,
             'worklogs': worklogs
             })
-    with open(output + '.json', 'w') as file_:
-        import json
-        json.dump(report, file_, indent=4, sort_keys=True, default=lambda o: '<not serializable>')
-    from jinja2 import Environment, FileSystemLoader
-    import arrow
-    env = Environment(loader=FileSystemLoader('./'),
-                      extensions=['jinja2.ext.loopcontrols'])
-    def datetimeformat(value):
-        return arrow.get(value).date()
+    return records
+
+
+def report_records(jira_instance, jql, workers=DEFAULT_WORKERS, cache=None,
+                   refresh=False, extra_fields=None, since=None,
+                   engine=None):
+    """Yields the report record of every issue matching jql, with the
+       changelog events after the since date, or all of them if since is
+       None. With a cache, only the issues whose updated timestamp changed
+       since they were cached are downloaded in full, the rest come from the
+       cache. With engine, an AsyncEngine, everything is fetched through
+       it"""
+    fields = REPORT_FIELDS + list((extra_fields or {}).values())
+    if engine is not None:
+        changelog = engine.changelog_reader(since)
+    else:
+        changelog = ChangelogReader(jira_instance, since)
+    if cache is None:
+        for issues in iter_issue_pages(jira_instance, jql, fields=fields,
+                                       engine=engine):
+            with profiling.span('enrich'):
+                records = report_page(jira_instance, issues, workers,
+                                      extra_fields, changelog, engine)
+            for record in records:
+                yield record
+        return
+
+    # a cheap listing of keys and timestamps tells us which issues are still
+    # in the query and which of them changed
+    cutoff = since.isoformat() if since else None
+    for page in iter_issue_pages(jira_instance, jql, fields=['updated'],
+                                 engine=engine):
+        with profiling.span('cache'):
+            cached = {} if refresh else \
+                cache.get(issue['key'] for issue in page)
+        records = {}
+        for issue in page:
+            updated, cached_since, record = cached.get(issue['key'],
+                                                       (None, None, None))
+            # a record read with an earlier cutoff holds every event needed
+            if record is None or \
+                    updated != issue['fields'].get('updated') or \
+                    (cached_since is not None and
+                     (cutoff is None or cached_since > cutoff)):
+                continue
+            if cutoff != cached_since:
+                record = dict(record, events=[
+                    event for event in record['events']
+                    if event['event']['created'][:10] > cutoff])
+            records[issue['key']] = record
+        stale = [issue['key'] for issue in page
+                 if issue['key'] not in records]
+        if stale:
+            stale_jql = "key in ({keys})".format(keys=','.join(stale))
+            fetched = []
+            for issues in iter_issue_pages(jira_instance, stale_jql,
+                                           fields=fields, engine=engine):
+                with profiling.span('enrich'):
+                    fetched.extend(report_page(jira_instance, issues,
+                                               workers, extra_fields,
+                                               changelog, engine))
+            with profiling.span('cache'):
+                cache.put(fetched, cutoff)
+            records.update((record['issue']['key'], record)
+                           for record in fetched)
+        print("Downloaded {} of {} issues, the rest came from the cache".format(
+            len(stale), len(page)))
+        for issue in page:
+            if issue['key'] in records:
+                yield records[issue['key']]
+
+
+def iso8601_to_date(value):
+    """Calendar date of a Jira ISO 8601 timestamp in its own UTC offset,
+       the same as arrow.get(value).date() without a full parse"""
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def report_cutoff():
+    """Date after which activity is reported, from JIRA_DATE if it is set"""
+    return iso8601_to_date(os.getenv('JIRA_DATE', DEFAULT_REPORT_DATE))
+
+
+def report_view(record, cutoff):
+    """Returns a ready to print copy of a report record, with its dates
+       parsed once and the changed/logged flags and recent worklogs worked out
+       against the cutoff date. Returns None if the issue needs no row"""
+    fields = record['fields']
+    updated = fields.get('updated')
+    status = fields.get('status', {}).get('name')
+    if not ((updated and iso8601_to_date(updated) > cutoff) or
+            status in REPORT_STATUSES):
+        return None
+    changed = any(iso8601_to_date(event['event']['created']) > cutoff
+                  for event in record['events'])
+    recent_worklogs = []
+    for worklog in record['worklogs']:
+        created = iso8601_to_date(worklog['worklog']['created'])
+        if created > cutoff:
+            recent_worklogs.append(dict(worklog, created=created))
+    return dict(record, changed=changed, logged=bool(recent_worklogs),
+                recent_worklogs=recent_worklogs)
+
+
+_template_environments = {}
+
+
+def template_environment(bytecode_dir=None):
+    """Jinja environment of the report templates in the working directory,
+       created once per process. With bytecode_dir, compiled templates are
+       kept there and reused by later runs until the template changes"""
+    key = (os.getcwd(), bytecode_dir)
+    if key not in _template_environments:
+        from jinja2 import (Environment, FileSystemBytecodeCache,
+                            FileSystemLoader)
+        import arrow
+        bytecode_cache = None
+        if bytecode_dir:
+            os.makedirs(bytecode_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+        env = Environment(loader=FileSystemLoader(key[0]),
+                          extensions=['jinja2.ext.loopcontrols'],
+                          bytecode_cache=bytecode_cache)
+
+        def datetimeformat(value):
+            return arrow.get(value).date()
 
-    def env_override(value, key):
-        return os.getenv(key, value)
+        def env_override(value, key):
+            return os.getenv(key, value)
 
-    env.filters['iso8601_to_time'] = datetimeformat
-    env.filters['env_override'] = env_override
-    template = env.get_template(template)
-    with open(output, 'w') as file_:
-        file_.write(template.render(data=report))
+        env.filters['iso8601_to_time'] = datetimeformat
+        env.filters['env_override'] = env_override
+        _template_environments[key] = env
+    return _template_environments[key]
+
+
+def report(jira_instance, sprint_name, board, template, output,
+           workers=DEFAULT_WORKERS, cache=None, refresh=False,
+           json_format='pretty', compress=False, field_registry=None,
+           report_fields=None, template_cache=None, export=None,
+           export_format='sqlite', sprints=None, engine=None):
+    """Writes the sprint's report records to a JSON file and renders the
+       template with the rows that need attention to output. Records are
+       streamed from Jira through both, so only a page of them is in memory
+       at a time. template_cache is a directory for compiled templates.
+       With export, the records are also exported as tables there. sprints
+       is the board's SprintIndex, listed from Jira if not given. With
+       engine, an AsyncEngine, the sprints and records are fetched through
+       it"""
+    extra_fields = None
+    if report_fields:
+        field_registry = field_registry or FieldRegistry(jira_instance)
+        extra_fields = dict(zip(report_fields,
+                                field_registry.ids_for(report_fields)))
+    cutoff = report_cutoff()
+    sprints = sprints or SprintIndex(list_sprints(jira_instance, board,
+                                                  engine=engine))
+    current_sprint = sprints.current(sprint_name)
+    print("Current sprint {} (id: {})".format(current_sprint['name'],
+                                              current_sprint['id']))
+    jql_query = "sprint={sprint_id}".format(sprint_id=current_sprint['id'])
+    json_output = output + ('.ndjson' if json_format == 'ndjson' else '.json')
+    template = template_environment(template_cache).get_template(template)
+
+    def views(writer, exporter):
+        for record in report_records(jira_instance, jql_query, workers,
+                                     cache, refresh, extra_fields, cutoff,
+                                     engine):
+            with profiling.span('serialize'):
+                writer.write(record)
+                if exporter is not None:
+                    exporter.write(record)
+            view = report_view(record, cutoff)
+            if view is not None:
+                # until the next view is asked for the template renders and
+                # writes this one, which is its own work
+                with profiling.span('write'):
+                    yield view
+
+    exporter = table_exporter(export, export_format) if export else None
+    try:
+        with JSONReportWriter(json_output, json_format, compress) as writer:
+            with open(output, 'w') as file_:
+                # the records are fetched as the template asks for them, so
+                # this span holds the search and enrich spans too
+                with profiling.span('render', "streams the records through "
+                                    "the template, so includes search, "
+                                    "enrich, serialize and write"):
+                    stream = template.stream(data=views(writer, exporter),
+                                             date=cutoff)
+                    stream.enable_buffering(100)
+                    stream.dump(file_)
+    finally:
+        if exporter is not None:
+            with profiling.span('export'):
+                exporter.close()
+
+
+def get_closed_sprints(sprints, count):
+    """Raw JSON of the last count closed sprints of a SprintIndex, oldest
+       first"""
+    sprints = sprints.in_state('closed')
+    sprints.sort(key=lambda sprint: sprint.get('completeDate') or
+                 sprint.get('endDate') or '')
+    return sprints[-count:]
+
+
+def report_history(jira_instance, board, count, output,
+                   workers=DEFAULT_WORKERS, cache=None, refresh=False,
+                   field_registry=None, points_field='Story Points',
+                   sprints=None, engine=None):
+    """Prints velocity, carry-over, cycle time and logged against estimated
+       hours over the board's last count closed sprints, and writes them to
+       output + '.history.json'. The sprints are fetched at the same time,
+       with their full changelogs. sprints is the board's SprintIndex, listed
+       from Jira if not given. With engine, an AsyncEngine, the sprints and
+       records are fetched through it"""
+    from sprint_tool.analytics import (ESTIMATE_FIELD, SprintHistory,
+                                       flatten_records, summary_tables,
+                                       timestamp)
+    import json
+    field_registry = field_registry or FieldRegistry(jira_instance)
+    extra_fields = {points_field: field_registry.id_for(points_field),
+                    ESTIMATE_FIELD: ESTIMATE_FIELD}
+    sprints = get_closed_sprints(
+        sprints or SprintIndex(list_sprints(jira_instance, board,
+                                            engine=engine)), count)
+
+    def fetch(sprint):
+        jql_query = "sprint={sprint_id}".format(sprint_id=sprint['id'])
+        return flatten_records(report_records(jira_instance, jql_query,
+                                              workers, cache, refresh,
+                                              extra_fields, engine=engine),
+                               points_field)
+
+    history = SprintHistory()
+    with profiling.span('history'):
+        sprint_rows = fetch_concurrently(fetch, sprints, HISTORY_WORKERS)
+    for sprint, rows in zip(sprints, sprint_rows):
+        end = sprint.get('completeDate') or sprint.get('endDate')
+        history.add({'name': sprint['name'],
+                     'end': timestamp(end) if end else float('inf')}, rows)
+    with profiling.span('analytics'):
+        summary = history.summary()
+    print(summary_tables(summary))
+    with open(output + '.history.json', 'w') as file_:
+        json.dump(summary, file_, indent=4, sort_keys=True)
 
 
 def can_sprint_roll_over(active_sprint):
@@ -417,7 +1032,7 @@ def can_sprint_roll_over(active_sprint):
     """
     current_date = datetime.now().isoformat().split('T')[0]
     print("Current Date: %s" % current_date)
-    end_date = active_sprint.endDate.split('T')[0]
+    end_date = active_sprint['endDate'].split('T')[0]
     print("Sprint End Date: %s" % end_date)
 
     if current_date >= end_date:
@@ -425,152 +1040,401 @@ def can_sprint_roll_over(active_sprint):
 
     return False
 
-def parse_args():
-    parser = argparse.ArgumentParser(usage='sprint-tool [OPTIONS]')
-    parser.add_argument('--assignees',
-                        type=lambda assign:
-                            ast.literal_eval(
-                                "['%s']" % assign.replace(" ", "").
-                                replace(",", "','")),
-                        action='store',
-                        dest='assignees',
-                        help="""
-                             Add users to assign tickets to in comma
-                             seperated list.
-                             Use either this or --role, but not both""")
-    parser.add_argument('-b', '--board',
+def parse_args(argv=None):
+    """Parses the command line. Only the standard library is needed for this,
+       the heavy dependencies of each command are imported when it runs"""
+    common = argparse.ArgumentParser(add_help=False)
+    jira_options = common.add_argument_group('Jira connection')
+    jira_options.add_argument('-s', '--server',
+                              action='store',
+                              type=str,
+                              dest='jira_server',
+                              required=True,
+                              help='Jira server base url')
+    jira_options.add_argument('-u', '--user',
+                              action='store',
+                              type=str,
+                              dest='jira_user',
+                              help='Username for Jira login')
+    jira_options.add_argument('-p', '--password',
+                              action='store',
+                              type=str,
+                              dest='jira_password',
+                              help='User password for Jira login')
+    jira_options.add_argument('--pool-size',
+                              action='store',
+                              dest='pool_size',
+                              default=transport.DEFAULT_POOL_SIZE,
+                              type=int,
+                              help='Number of hosts to keep HTTP connections to')
+    jira_options.add_argument('--max-connections',
+                              action='store',
+                              dest='max_connections',
+                              default=transport.DEFAULT_MAX_CONNECTIONS,
+                              type=int,
+                              help='Most HTTP connections kept open per host')
+    jira_options.add_argument('--timeout',
+                              action='store',
+                              dest='timeout',
+                              default=transport.DEFAULT_TIMEOUT,
+                              type=float,
+                              help='''Seconds to wait for a Jira connection or
+                              response''')
+    jira_options.add_argument('--http-retries',
+                              action='store',
+                              dest='http_retries',
+                              default=transport.DEFAULT_HTTP_RETRIES,
+                              type=int,
+                              help="""Times to retry a read request that was
+                              throttled, failed with a server error or timed
+                              out""")
+    jira_options.add_argument('--backoff',
+                              action='store',
+                              dest='backoff',
+                              default=transport.DEFAULT_BACKOFF,
+                              type=float,
+                              help="""Seconds to wait before the first HTTP
+                              retry, doubled for every retry after it.
+                              Retry-After from the server takes precedence""")
+    jira_options.add_argument('--workers',
+                              action='store',
+                              dest='workers',
+                              default=DEFAULT_WORKERS,
+                              type=int,
+                              help="""Maximum number of concurrent requests to
+                              make against the Jira server""")
+    jira_options.add_argument('--retries',
+                              action='store',
+                              dest='retries',
+                              default=DEFAULT_RETRIES,
+                              type=int,
+                              help="""Times to retry a write request that was
+                              throttled or failed with a server error""")
+    jira_options.add_argument('--engine',
+                              action='store',
+                              dest='engine',
+                              default='sync',
+                              choices=['sync', 'async'],
+                              help="""How searches, worklogs, changelogs,
+                              sprint listings, comments, bulk creates and
+                              watchers are sent. async sends them from one
+                              asyncio event loop, with up to
+                              --max-connections in flight instead of
+                              --workers threads, and needs httpx""")
+    cache_options = common.add_argument_group('Local cache')
+    cache_options.add_argument('--cache-dir',
+                               action='store',
+                               dest='cache_dir',
+                               default=DEFAULT_CACHE_DIR,
+                               type=str,
+                               help='Directory for the local caches')
+    cache_options.add_argument('--cache-ttl',
+                               action='store',
+                               dest='cache_ttl',
+                               default=DEFAULT_CACHE_TTL // (24 * 60 * 60),
+                               type=int,
+                               help="""Days after which issues that were not
+                               refreshed are dropped from the cache""")
+    cache_options.add_argument('--no-cache',
+                               action='store_true',
+                               dest='no_cache',
+                               help='Do not read or write the local caches')
+    cache_options.add_argument('--refresh',
+                               action='store_true',
+                               dest='refresh',
+                               help="""Download everything again and replace
+                               what is in the local caches""")
+    sprint_options = common.add_argument_group('Sprints')
+    sprint_options.add_argument('--sprint-pattern',
+                                action='store',
+                                dest='sprint_pattern',
+                                default=DEFAULT_SPRINT_PATTERN,
+                                type=str,
+                                help="""Regular expression splitting sprint
+                                names into a prefix and number group, by
+                                default names like "Team Sprint #12".""")
+    profile_options = common.add_argument_group('Profiling')
+    profile_options.add_argument('--profile',
+                                 action='store_true',
+                                 dest='profile',
+                                 help="""Print how long each stage took and how
+                                 many calls were made to Jira and LDAP, by
+                                 endpoint""")
+    profile_options.add_argument('--profile-trace',
+                                 action='store',
+                                 dest='profile_trace',
+                                 type=str,
+                                 help="""Also write the profile to this file in
+                                 Chrome's trace event format, implies
+                                 --profile""")
+
+    parser = argparse.ArgumentParser(
+        prog='sprint-tool',
+        description='A tool for managing Jira sprints')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    roll = commands.add_parser('roll', parents=[common],
+                               help='Roll over the sprints of a board')
+    roll.add_argument('-b', '--board',
+                      action='store',
+                      type=str,
+                      dest='jira_board',
+                      help='Jira board to work with')
+    roll.add_argument('-n', '--sprint-name',
+                      action='store',
+                      type=str,
+                      dest='sprint_name',
+                      help="""
+                          Text prefix of the Sprint name, eg if an
+                          individual sprint would be 'Team Sprint #1' the
+                          text prefix would be 'Team Sprint'
+                          """)
+    roll.add_argument('-l', '--sprint-length',
+                      action='store',
+                      type=int,
+                      dest='sprint_length',
+                      help='Sprint duration in weeks')
+    roll.add_argument('--boards-config',
+                      action='store',
+                      type=str,
+                      dest='boards_config',
+                      help="""JSON or YAML file listing the boards to roll
+                      over, instead of --board and --sprint-name:
+                      [{"board": 1, "sprint_name": "Team Sprint",
+                      "force": false}, ...]""")
+    roll.add_argument('--board-workers',
+                      action='store',
+                      dest='board_workers',
+                      default=4,
+                      type=int,
+                      help='Number of boards to roll over at the same time')
+    roll.add_argument('--force',
+                      action='store_true',
+                      dest='force',
+                      help="""To force the sprint roll over if it's before the
+                      end sprint date.""")
+
+    report = commands.add_parser('report', parents=[common],
+                                 help='Create report for specified sprint')
+    report.add_argument('-b', '--board',
                         action='store',
                         type=str,
                         dest='jira_board',
+                        required=True,
                         help='Jira board to work with')
-    parser.add_argument('--copy_epic_to_task',
-                        action='store_true',
-                        dest='copy_epic_to_task',
-                        help='Copy the specified epic to tasks for everyone'
-                             ' in the specified role')
-    parser.add_argument('-e', '--epic',
+    report.add_argument('-n', '--sprint-name',
                         action='store',
                         type=str,
-                        dest='epic_id',
-                        help='epic to work with')
-    parser.add_argument('-j', '--project',
-                        action='store',
-                        type=str,
-                        dest='project_id',
-                        help='Project to work with')
-    parser.add_argument('-l', '--sprint-length',
-                        action='store',
-                        type=int,
-                        dest='sprint_length',
-                        help='Sprint duration in weeks')
-    parser.add_argument('--labels',
-                        type=lambda labeldict: ast.literal_eval(labeldict),
-                        action='store',
-                        dest='labels',
-                        help="""
-                             Add label to tickets of specific users. This is a
-                             a dictionary, label: list of users to label:
-                             {"label1": ["to_label_1","to_label_2"],...}""")
-    parser.add_argument('-p', '--password',
-                        action='store',
-                        type=str,
-                        dest='jira_password',
-                        help='User password for Jira login')
-    parser.add_argument('--summary-prefix',
-                        type=lambda prefixdict: ast.literal_eval(prefixdict),
-                        action='store',
-                        dest='prefixes',
-                        help="""
-                             Add prefixes to tickets of specific
-                             users. This is a dictionary, same format as
-                             labels. It is added to the title within brackets
-                             (e.g. [prefix]). Prefixes are unique, so there
-                             can be only one assignee per prefix""")
-    parser.add_argument('--role',
+                        dest='sprint_name',
+                        help="""Text prefix of the Sprint name, required
+                        unless --history is given""")
+    report.add_argument('--template',
                         action='store',
+                        dest='template',
+                        default='report.html.j2',
                         type=str,
-                        dest='role',
-                        help="""The role to process the actions against.
-                                Either use this or --assignees, not both""")
-    parser.add_argument('-r', '--roll-sprints',
-                        action='store_true',
-                        dest='roll_sprints',
-                        help='Actually change the sprints')
-    parser.add_argument('-s', '--server',
+                        help='Path to Jinja template to process for the report')
+    report.add_argument('--output',
                         action='store',
+                        dest='output',
+                        default='report.html',
                         type=str,
-                        dest='jira_server',
-                        help='Jira server base url')
-    parser.add_argument('-n', '--sprint-name',
-                        action='store',
+                        help='Report output path')
+    report.add_argument('--report-field',
+                        action='append',
+                        dest='report_fields',
+                        default=[],
                         type=str,
-                        dest='sprint_name',
-                        help="""
-                            Text prefix of the Sprint name, eg if an
-                            individual sprint would be 'Team Sprint #1' the
-                            text prefix would be 'Team Sprint'
-                            """)
-    parser.add_argument('--ticket-comment',
+                        help="""Name of an extra field, e.g. a custom field
+                        like 'Story Points', to add to the report data under
+                        its name. Can be given several times""")
+    report.add_argument('--json-format',
                         action='store',
-                        type=str,
-                        dest='ticket_comment',
-                        help='Comment on ticket')
-    parser.add_argument('--ticket-comment-manager-cc',
+                        dest='json_format',
+                        default='pretty',
+                        choices=JSON_FORMATS,
+                        help="""Format of the JSON dump written next to the
+                        report. ndjson writes one issue per line""")
+    report.add_argument('--gzip',
                         action='store_true',
-                        dest='ticket_comment_manager_cc',
-                        default=False,
-                        help='Comment on ticket')
-    parser.add_argument('--ticket-comment-manager-ldap',
+                        dest='gzip',
+                        help='Gzip the JSON dump written next to the report')
+    report.add_argument('--export',
                         action='store',
+                        dest='export',
                         type=str,
-                        dest='ticket_comment_manager_ldap',
-                        help='LDAP server to find out who the manager is')
-    parser.add_argument('--ticket-comment-manager-ldapbasedn',
+                        help="""Also export the report data as issues,
+                        fields, events, change_items and worklogs tables to
+                        this SQLite file, or directory for csv and
+                        parquet""")
+    report.add_argument('--export-format',
                         action='store',
-                        type=str,
-                        dest='ticket_comment_manager_ldapbasedn',
-                        help='LDAP basedn to find out who the manager is')
-    parser.add_argument('--ticket-comment-query',
+                        dest='export_format',
+                        default='sqlite',
+                        choices=EXPORT_FORMATS,
+                        help='Format of --export, parquet needs pyarrow')
+    report.add_argument('--history',
                         action='store',
+                        dest='history',
+                        type=int,
+                        help="""Instead of the report, print velocity,
+                        carry-over, cycle time and logged against estimated
+                        hours over the board's last HISTORY closed sprints,
+                        and write them to <output>.history.json. Needs
+                        NumPy""")
+    report.add_argument('--points-field',
+                        action='store',
+                        dest='points_field',
+                        default='Story Points',
                         type=str,
-                        dest='ticket_comment_query',
-                        help='Query to use when adding comment')
-    parser.add_argument('-u', '--user',
+                        help='Name of the story points field for --history')
+
+    copy_epic = commands.add_parser(
+        'copy-epic', parents=[common],
+        help="""Copy the specified epic to tasks for everyone in the specified
+             role""")
+    copy_epic.add_argument('-j', '--project',
+                           action='store',
+                           type=str,
+                           dest='project_id',
+                           required=True,
+                           help='Project to work with')
+    copy_epic.add_argument('-e', '--epic',
+                           action='store',
+                           type=str,
+                           dest='epic_id',
+                           required=True,
+                           help='epic to work with')
+    assign = copy_epic.add_mutually_exclusive_group(required=True)
+    assign.add_argument('--role',
                         action='store',
                         type=str,
-                        dest='jira_user',
-                        help='Username for Jira login')
-    parser.add_argument('--watch',
-                        type=lambda watchdict: ast.literal_eval(watchdict),
+                        dest='role',
+                        help="""The role to process the actions against.
+                                Either use this or --assignees, not both""")
+    assign.add_argument('--assignees',
+                        type=lambda assign:
+                            ast.literal_eval(
+                                "['%s']" % assign.replace(" ", "").
+                                replace(",", "','")),
                         action='store',
-                        dest='watchers',
+                        dest='assignees',
                         help="""
+                             Add users to assign tickets to in comma
+                             seperated list.
+                             Use either this or --role, but not both""")
+    copy_epic.add_argument('--labels',
+                           type=lambda labeldict: ast.literal_eval(labeldict),
+                           action='store',
+                           dest='labels',
+                           help="""
+                             Add label to tickets of specific users. This is a
+                             a dictionary, label: list of users to label:
+                             {"label1": ["to_label_1","to_label_2"],...}""")
+    copy_epic.add_argument('--summary-prefix',
+                           type=lambda prefixdict: ast.literal_eval(prefixdict),
+                           action='store',
+                           dest='prefixes',
+                           help="""
+                             Add prefixes to tickets of specific
+                             users. This is a dictionary, same format as
+                             labels. It is added to the title within brackets
+                             (e.g. [prefix]). Prefixes are unique, so there
+                             can be only one assignee per prefix""")
+    copy_epic.add_argument('--watch',
+                           type=lambda watchdict: ast.literal_eval(watchdict),
+                           action='store',
+                           dest='watchers',
+                           help="""
                              Add watchers for specific users. This is a
                              a dictionary, watcher: list of watchees:
                              {"watcher": ["to_watch_1","to_watch_2"]}""")
-    parser.add_argument('--report',
-                        action='store_true',
-                        dest='report',
-                        help="""
-                             Create report for specified sprint
-                        """)
-    parser.add_argument('--template',
-                        action='store',
-                        dest='template',
-                        default='report.html.j2',
-                        type=str,
-                        help='Path to Jinja template to process for the report')
-    parser.add_argument('--output',
-                        action='store',
-                        dest='output',
-                        default='report.html',
-                        type=str,
-                        help='Report output path')
-    parser.add_argument('--force',
-                        action='store_true',
-                        dest='force',
-                        help="""To force an action. Typically used with --roll-sprint
-                        to force sprint roll over if it's before the end sprint date.""")
-    args = parser.parse_args()
+
+    comment = commands.add_parser('comment', parents=[common],
+                                  help='Comment on the tickets of a query')
+    comment.add_argument('--ticket-comment',
+                         action='store',
+                         type=str,
+                         dest='ticket_comment',
+                         required=True,
+                         help='Comment on ticket')
+    comment.add_argument('--ticket-comment-query',
+                         action='store',
+                         type=str,
+                         dest='ticket_comment_query',
+                         required=True,
+                         help='Query to use when adding comment')
+    comment.add_argument('--ticket-comment-manager-cc',
+                         action='store_true',
+                         dest='ticket_comment_manager_cc',
+                         default=False,
+                         help="CC the assignee's manager in the comment")
+    comment.add_argument('--ticket-comment-manager-ldap',
+                         action='store',
+                         type=str,
+                         dest='ticket_comment_manager_ldap',
+                         help='LDAP server to find out who the manager is')
+    comment.add_argument('--ticket-comment-manager-ldapbasedn',
+                         action='store',
+                         type=str,
+                         dest='ticket_comment_manager_ldapbasedn',
+                         help='LDAP basedn to find out who the manager is')
+    comment.add_argument('--rate-limit',
+                         action='store',
+                         dest='rate_limit',
+                         type=float,
+                         help="""Maximum number of comments per second to send
+                         to the Jira server""")
+    comment.add_argument('--checkpoint',
+                         action='store',
+                         dest='checkpoint',
+                         type=str,
+                         help="""File recording the tickets that were already
+                         commented on. Running again with the same file skips
+                         them""")
+
+    serve = commands.add_parser(
+        'serve', parents=[common],
+        help="""Keep running, roll over sprints and write reports on the
+             schedule of a config file, and serve reports over HTTP""")
+    serve.add_argument('--config',
+                       action='store',
+                       dest='config',
+                       required=True,
+                       type=str,
+                       help="""JSON or YAML file of jobs: {"jobs": [{"name":
+                       "nightly", "command": "roll" or "report", "every":
+                       <seconds>, "board": <id>, "sprint_name": <prefix>,
+                       ...}], "report_max_age": <seconds>}. Report jobs take
+                       output, template, report_fields and json_format, roll
+                       jobs take force""")
+    serve.add_argument('--listen',
+                       action='store',
+                       dest='listen',
+                       default='127.0.0.1:8089',
+                       type=str,
+                       help='Address and port to serve the HTTP API on')
+    serve.add_argument('--socket',
+                       action='store',
+                       dest='socket',
+                       type=str,
+                       help='Serve the HTTP API on this Unix socket instead')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'roll' and not args.boards_config and \
+            not (args.jira_board and args.sprint_name):
+        roll.error("either --boards-config or both --board and --sprint-name "
+                   "are required")
+    if args.command == 'report' and not args.history and \
+            not args.sprint_name:
+        report.error("--sprint-name is required unless --history is given")
+    if args.command == 'comment' and args.ticket_comment_manager_cc and \
+            not (args.ticket_comment_manager_ldap and
+                 args.ticket_comment_manager_ldapbasedn):
+        comment.error("--ticket-comment-manager-cc needs "
+                      "--ticket-comment-manager-ldap and "
+                      "--ticket-comment-manager-ldapbasedn")
 
     return args
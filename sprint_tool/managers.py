@@ -0,0 +1,119 @@
+"""
+Looks up the managers of Jira users in LDAP.
+"""
+import json
+import os
+import re
+import time
+
+from sprint_tool import profiling
+
+# Managers read from the on-disk cache are trusted for this long.
+DEFAULT_MANAGER_TTL = 24 * 60 * 60
+
+# Number of users resolved by a single LDAP OR filter.
+LDAP_BATCH_SIZE = 100
+
+# python-ldap's ldap.SCOPE_SUBTREE, which is the LDAP protocol's value.
+SCOPE_SUBTREE = 2
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def escape_filter_chars(value):
+    """Escapes the characters RFC 4515 reserves in filter values, like
+       python-ldap's ldap.filter.escape_filter_chars()"""
+    return "".join("\\%02x" % ord(char) if char in '\\*()\x00' else char
+                   for char in value)
+
+
+def explode_dn(dn):
+    """Splits a DN into its RDNs, like python-ldap's ldap.explode_dn()"""
+    return [rdn.strip() for rdn in re.split(r'(?<!\\),', dn) if rdn.strip()]
+
+
+class ManagerLookup(object):
+    """Resolves the manager of each user over a single LDAP connection and
+       remembers every answer for the rest of the run. With a cache_file the
+       answers are also kept across runs for ttl seconds.
+
+       connection can be any object with python-ldap's search_s() and
+       unbind_s(), e.g. a stand-in for a local test directory. python-ldap
+       is only needed without one. escape and explode replace the filter
+       escaping and DN splitting, which are python-ldap's when it connects
+       and this module's otherwise."""
+
+    def __init__(self, ldap_server, basedn, cache_file=None,
+                 ttl=DEFAULT_MANAGER_TTL, connection=None, escape=None,
+                 explode=None):
+        if connection is None:
+            # this is here because it is only required when a manager is
+            # CCed. So it is not a requirement for the whole script
+            import ldap
+            import ldap.filter
+            connection = ldap.initialize(ldap_server)
+            escape = escape or ldap.filter.escape_filter_chars
+            explode = explode or ldap.explode_dn
+        self.connection = connection
+        self.escape = escape or escape_filter_chars
+        self.explode = explode or explode_dn
+        self.basedn = basedn
+        self.cache_file = cache_file
+        self.ttl = ttl
+        # uid: (manager or None, time it was looked up)
+        self.managers = {}
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file) as file_:
+                cached = json.load(file_)
+            oldest = time.time() - ttl
+            self.managers = {uid: (manager, looked_up)
+                             for uid, (manager, looked_up) in cached.items()
+                             if looked_up >= oldest}
+
+    def prefetch(self, uids):
+        """Looks up every uid that is not known yet, batching them into OR
+           filters instead of one search per user"""
+        unknown = sorted(set(uid for uid in uids if uid) - set(self.managers))
+        for start in range(0, len(unknown), LDAP_BATCH_SIZE):
+            batch = unknown[start:start + LDAP_BATCH_SIZE]
+            l_filter = "(|%s)" % "".join(
+                "(uid=%s)" % self.escape(uid)
+                for uid in batch)
+            with profiling.call('LDAP search'):
+                results = self.connection.search_s(self.basedn,
+                                                   SCOPE_SUBTREE, l_filter,
+                                                   ["uid", "manager"])
+            now = time.time()
+            # LDAP matches uids without regard to case and an entry may have
+            # several, so tie each entry back to the uids it was found for
+            requested = {}
+            for uid in batch:
+                self.managers[uid] = (None, now)
+                requested.setdefault(uid.lower(), []).append(uid)
+            for _, attrs in results:
+                if not attrs or "uid" not in attrs:
+                    continue
+                manager = None
+                if attrs.get("manager"):
+                    manager_dn = _text(attrs["manager"][0])
+                    manager = self.explode(manager_dn)[0].split("=")[1]
+                for value in attrs["uid"]:
+                    for uid in requested.get(_text(value).lower(), []):
+                        self.managers[uid] = (manager, now)
+
+    def manager(self, uid):
+        """Returns the manager's uid, or None if the user has no manager"""
+        if uid not in self.managers:
+            self.prefetch([uid])
+        return self.managers[uid][0]
+
+    def close(self):
+        if self.cache_file:
+            directory = os.path.dirname(self.cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.cache_file, 'w') as file_:
+                json.dump(self.managers, file_)
+        self.connection.unbind_s()
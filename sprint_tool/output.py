@@ -0,0 +1,271 @@
+"""
+Writers for the machine-readable report dump, and exporters of the same
+records as normalized tables for querying.
+"""
+import csv
+import gzip
+import json
+import os
+
+JSON_FORMATS = ('pretty', 'compact', 'ndjson')
+
+
+def _not_serializable(value):
+    return '<not serializable>'
+
+
+class JSONReportWriter(object):
+    """Writes report records to disk one at a time, so only the record being
+       written has to be in memory.
+
+       pretty: an indented JSON array, the same as the historical dump
+       compact: a JSON array without any whitespace
+       ndjson: one compact JSON record per line"""
+
+    def __init__(self, path, json_format='pretty', compress=False):
+        if json_format not in JSON_FORMATS:
+            raise ValueError("Unknown JSON format: %s" % json_format)
+        if compress:
+            path += '.gz'
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self.file = open(path, 'w')
+        self.path = path
+        self.json_format = json_format
+        self.count = 0
+        if json_format != 'ndjson':
+            self.file.write('[')
+
+    def write(self, record):
+        if self.json_format == 'pretty':
+            text = json.dumps(record, indent=4, sort_keys=True,
+                              default=_not_serializable)
+            self.file.write(',\n' if self.count else '\n')
+            self.file.write('\n'.join('    ' + line
+                                      for line in text.split('\n')))
+        else:
+            text = json.dumps(record, sort_keys=True, separators=(',', ':'),
+                              default=_not_serializable)
+            if self.json_format == 'ndjson':
+                self.file.write(text + '\n')
+            else:
+                self.file.write(',' + text if self.count else text)
+        self.count += 1
+
+    def close(self):
+        if self.json_format == 'pretty':
+            self.file.write('\n]' if self.count else ']')
+        elif self.json_format == 'compact':
+            self.file.write(']')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+EXPORT_FORMATS = ('sqlite', 'csv', 'parquet')
+
+# Normalized tables of the report records, with their columns and types.
+EXPORT_TABLES = [
+    ('issues', [('key', 'TEXT'), ('id', 'TEXT'), ('summary', 'TEXT'),
+                ('status', 'TEXT'), ('assignee', 'TEXT'),
+                ('updated', 'TEXT')]),
+    ('fields', [('issue_key', 'TEXT'), ('field', 'TEXT'),
+                ('value', 'TEXT')]),
+    ('events', [('issue_key', 'TEXT'), ('event_id', 'TEXT'),
+                ('author', 'TEXT'), ('created', 'TEXT')]),
+    ('change_items', [('issue_key', 'TEXT'), ('event_id', 'TEXT'),
+                      ('field', 'TEXT'), ('from_string', 'TEXT'),
+                      ('to_string', 'TEXT')]),
+    ('worklogs', [('issue_key', 'TEXT'), ('worklog_id', 'TEXT'),
+                  ('author', 'TEXT'), ('created', 'TEXT'),
+                  ('started', 'TEXT'), ('time_spent_seconds', 'INTEGER'),
+                  ('comment', 'TEXT')]),
+]
+
+# Indexed columns of the SQLite export, by table.
+EXPORT_INDEXES = [
+    ('issues', 'key'), ('issues', 'assignee'), ('issues', 'updated'),
+    ('fields', 'issue_key'),
+    ('events', 'issue_key'), ('events', 'author'), ('events', 'created'),
+    ('change_items', 'issue_key'), ('change_items', 'event_id'),
+    ('worklogs', 'issue_key'), ('worklogs', 'author'),
+    ('worklogs', 'created'), ('worklogs', 'started'),
+]
+
+# Records buffered before their rows are handed to the database or file.
+EXPORT_BATCH_SIZE = 500
+
+
+def _name(user):
+    return (user or {}).get('name')
+
+
+def _text(value):
+    return value if isinstance(value, str) else \
+        json.dumps(value, sort_keys=True, default=_not_serializable)
+
+
+def record_rows(record):
+    """Splits a report record into rows of the EXPORT_TABLES, returned as a
+       dict of table name: list of row tuples"""
+    key = record['issue']['key']
+    fields = record['fields']
+    rows = {
+        'issues': [(key, record['issue'].get('id'), fields.get('summary'),
+                    fields.get('status', {}).get('name'),
+                    _name(fields.get('assignee')), fields.get('updated'))],
+        'fields': [(key, name, _text(value))
+                   for name, value in sorted(fields.items())],
+        'events': [],
+        'change_items': [],
+        'worklogs': [],
+    }
+    for event in record['events']:
+        event_id = event['event'].get('id')
+        rows['events'].append((key, event_id, _name(event['author']),
+                               event['event'].get('created')))
+        rows['change_items'].extend(
+            (key, event_id, change.get('field'), change.get('fromString'),
+             change.get('toString')) for change in event['changes'])
+    for worklog in record['worklogs']:
+        rows['worklogs'].append((key, worklog['worklog'].get('id'),
+                                 _name(worklog['author']),
+                                 worklog['worklog'].get('created'),
+                                 worklog['worklog'].get('started'),
+                                 worklog['worklog'].get('timeSpentSeconds'),
+                                 worklog['worklog'].get('comment')))
+    return rows
+
+
+class TableExporter(object):
+    """Writes report records as the normalized EXPORT_TABLES, a batch of
+       records at a time. Subclasses store the rows, see write_rows()"""
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = {table: [] for table, _ in EXPORT_TABLES}
+        self.buffered = 0
+
+    def write(self, record):
+        for table, rows in record_rows(record).items():
+            self.pending[table].extend(rows)
+        self.buffered += 1
+        if self.buffered >= EXPORT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for table, _ in EXPORT_TABLES:
+            if self.pending[table]:
+                self.write_rows(table, self.pending[table])
+                self.pending[table] = []
+        self.buffered = 0
+
+    def write_rows(self, table, rows):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SQLiteExporter(TableExporter):
+    """Exports to a SQLite database, replacing any previous export. All rows
+       go in with bulk inserts inside one transaction, and the indexes are
+       built once at the end"""
+
+    def __init__(self, path):
+        # only needed for the export, keep it off the startup path
+        import sqlite3
+        super(SQLiteExporter, self).__init__(path)
+        if os.path.exists(path):
+            os.remove(path)
+        self.connection = sqlite3.connect(path)
+        for table, columns in EXPORT_TABLES:
+            self.connection.execute("CREATE TABLE {} ({})".format(
+                table, ', '.join('%s %s' % column for column in columns)))
+
+    def write_rows(self, table, rows):
+        self.connection.executemany(
+            "INSERT INTO {} VALUES ({})".format(
+                table, ','.join('?' * len(rows[0]))), rows)
+
+    def close(self):
+        self.flush()
+        for table, column in EXPORT_INDEXES:
+            self.connection.execute(
+                "CREATE INDEX {0}_{1} ON {0} ({1})".format(table, column))
+        self.connection.commit()
+        self.connection.close()
+
+
+class CSVExporter(TableExporter):
+    """Exports to a directory with a <table>.csv file per table"""
+
+    def __init__(self, path):
+        super(CSVExporter, self).__init__(path)
+        os.makedirs(path, exist_ok=True)
+        self.files = {}
+        self.writers = {}
+        for table, columns in EXPORT_TABLES:
+            self.files[table] = open(os.path.join(path, table + '.csv'), 'w',
+                                     newline='')
+            self.writers[table] = csv.writer(self.files[table])
+            self.writers[table].writerow([name for name, _ in columns])
+
+    def write_rows(self, table, rows):
+        self.writers[table].writerows(rows)
+
+    def close(self):
+        self.flush()
+        for file_ in self.files.values():
+            file_.close()
+
+
+class ParquetExporter(TableExporter):
+    """Exports to a directory with a <table>.parquet file per table, one row
+       group per batch. Needs pyarrow, which is not a requirement of the
+       tool"""
+
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        super(ParquetExporter, self).__init__(path)
+        os.makedirs(path, exist_ok=True)
+        types = {'TEXT': pyarrow.string(), 'INTEGER': pyarrow.int64()}
+        self.pyarrow = pyarrow
+        self.schemas = {}
+        self.writers = {}
+        for table, columns in EXPORT_TABLES:
+            self.schemas[table] = pyarrow.schema(
+                [(name, types[kind]) for name, kind in columns])
+            self.writers[table] = pyarrow.parquet.ParquetWriter(
+                os.path.join(path, table + '.parquet'), self.schemas[table])
+
+    def write_rows(self, table, rows):
+        schema = self.schemas[table]
+        columns = [list(column) for column in zip(*rows)]
+        self.writers[table].write_table(self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array(column, type=field.type)
+             for column, field in zip(columns, schema)], schema=schema))
+
+    def close(self):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+
+
+def table_exporter(path, export_format='sqlite'):
+    """Opens the exporter of an EXPORT_FORMATS format"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format: %s" % export_format)
+    return {'sqlite': SQLiteExporter, 'csv': CSVExporter,
+            'parquet': ParquetExporter}[export_format](path)
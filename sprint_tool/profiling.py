@@ -0,0 +1,173 @@
+"""
+Counts and times outbound calls and the stages of each command, for the
+--profile summary and Chrome trace output.
+
+Profiling is off unless enable() is called. While it is off span() and
+call() hand back a shared do-nothing context manager, so instrumented code
+pays for little more than a function call.
+"""
+from contextlib import contextmanager
+import json
+import re
+import threading
+import time
+
+from sprint_tool.tables import text_table
+
+# Path segments that identify a single resource, replaced so calls are
+# counted per endpoint rather than per issue or sprint.
+_RESOURCE_ID = re.compile(r'^(\d+|[A-Z][A-Z0-9_]*-\d+)$')
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class NullProfiler(object):
+    """Stand-in used while profiling is off"""
+
+    def span(self, name, note=None):
+        return _NULL_CONTEXT
+
+    def call(self, endpoint):
+        return _NULL_CONTEXT
+
+    def hook_session(self, session):
+        pass
+
+
+def endpoint_name(method, url):
+    """e.g. GET /rest/api/2/issue/PROJ-12/worklog?a=b becomes
+       GET /rest/api/2/issue/{id}/worklog"""
+    path = url.split('?', 1)[0]
+    if '://' in path:
+        path = '/' + path.split('://', 1)[1].split('/', 1)[-1]
+    segments = path.split('/')
+    for index in range(1, len(segments)):
+        # the segment after api/agile/auth is the API version, keep it
+        if _RESOURCE_ID.match(segments[index]) and \
+                segments[index - 1] not in ('api', 'agile', 'auth'):
+            segments[index] = '{id}'
+    return "%s %s" % (method, '/'.join(segments))
+
+
+class Profiler(object):
+    """Collects spans, named stages of a command, and calls, single requests
+       to Jira or LDAP. Both can be recorded from any thread"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        # (category, name, start, duration, thread id)
+        self.events = []
+        # span name: what the span takes in besides its own work
+        self.notes = {}
+
+    def _record(self, category, name, start, duration):
+        with self.lock:
+            self.events.append((category, name, start - self.origin,
+                                duration, threading.current_thread().ident))
+
+    @contextmanager
+    def _timed(self, category, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(category, name, start, time.perf_counter() - start)
+
+    def span(self, name, note=None):
+        """Times a stage of a command, e.g. search or render. note says what
+           the stage includes that isn't obvious from its name, and is
+           shown under the summary"""
+        if note is not None:
+            self.notes[name] = note
+        return self._timed('span', name)
+
+    def call(self, endpoint):
+        """Times a single outbound call that doesn't go through the Jira
+           session, e.g. an LDAP search"""
+        return self._timed('call', endpoint)
+
+    def hook_session(self, session):
+        """Records every response received by a requests session"""
+        session.hooks.setdefault('response', []).append(self._on_response)
+
+    def _on_response(self, response, *args, **kwargs):
+        duration = response.elapsed.total_seconds()
+        self._record('call', endpoint_name(response.request.method,
+                                           response.request.url),
+                     time.perf_counter() - duration, duration)
+
+    def totals(self, category):
+        """Returns {name: (count, total seconds, max seconds)}"""
+        totals = {}
+        with self.lock:
+            events = list(self.events)
+        for event_category, name, _, duration, _ in events:
+            if event_category != category:
+                continue
+            count, total, longest = totals.get(name, (0, 0.0, 0.0))
+            totals[name] = (count + 1, total + duration,
+                            max(longest, duration))
+        return totals
+
+    def summary(self):
+        """Formats the spans and calls as plain text tables"""
+        lines = []
+        for category, title in (('span', 'Stage'), ('call', 'Call')):
+            totals = self.totals(category)
+            if not totals:
+                continue
+            rows = [(title, "Count", "Total", "Average", "Max")]
+            for name, (count, total, longest) in sorted(
+                    totals.items(), key=lambda item: -item[1][1]):
+                rows.append((name, str(count), "%.3fs" % total,
+                             "%.3fs" % (total / count), "%.3fs" % longest))
+            lines.append(text_table(rows))
+            if category == 'span':
+                lines.extend("%s: %s" % (name, self.notes[name])
+                             for name in sorted(totals) if name in self.notes)
+            lines.append("")
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """Writes the events in Chrome's trace event format, viewable in
+           chrome://tracing or Perfetto"""
+        with self.lock:
+            events = list(self.events)
+        trace = [{'name': name, 'cat': category, 'ph': 'X',
+                  'ts': int(start * 1e6), 'dur': int(duration * 1e6),
+                  'pid': 1, 'tid': thread}
+                 for category, name, start, duration, thread in events]
+        with open(path, 'w') as file_:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file_)
+
+
+_profiler = NullProfiler()
+
+
+def enable():
+    """Turns profiling on and returns the profiler collecting the events"""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def span(name, note=None):
+    return _profiler.span(name, note)
+
+
+def call(endpoint):
+    return _profiler.call(endpoint)
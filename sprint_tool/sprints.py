@@ -0,0 +1,121 @@
+"""
+Index of a board's sprints, built from one paginated listing and kept on
+disk for a short while, so finding the current, next and newest sprint of
+a team doesn't list and scan the board's sprints again every time.
+"""
+import json
+import os
+import re
+import time
+
+# Sprint names are a team prefix and a number, e.g. "Team Sprint #12".
+# Patterns need a prefix and a number group.
+DEFAULT_SPRINT_PATTERN = r'^(?P<prefix>.*?)\s*#\s*(?P<number>\d+)\s*$'
+
+# Sprints requested per page of the listing, the most the agile API sends.
+SPRINT_PAGE_SIZE = 50
+
+# The sprint listing on disk is trusted for this long. Roll-overs, which
+# change it, always list the sprints again and drop the cached listing.
+DEFAULT_SPRINT_TTL = 10 * 60
+
+
+def list_sprints(jira_instance, board_id, page_size=SPRINT_PAGE_SIZE,
+                 engine=None):
+    """Raw JSON of every sprint of a board, in any state. Listed through
+       engine, an AsyncEngine, if given"""
+    if engine is not None:
+        return engine.list_sprints(board_id, page_size)
+    sprints = []
+    while True:
+        page = jira_instance._get_json(
+            'board/{}/sprint'.format(board_id),
+            params={'startAt': len(sprints), 'maxResults': page_size},
+            base=jira_instance.AGILE_BASE_URL)
+        sprints.extend(page['values'])
+        if page.get('isLast', True) or not page['values']:
+            return sprints
+
+
+class SprintIndex(object):
+    """Sprints of a board by name prefix. Names are parsed with pattern once,
+       sprints whose name doesn't match are left out"""
+
+    def __init__(self, sprints, pattern=DEFAULT_SPRINT_PATTERN):
+        self.sprints = sprints
+        self.regex = regex = re.compile(pattern)
+        # prefix: active sprint, (number, future sprint), (number, sprint)
+        self.current_sprints = {}
+        self.next_sprints = {}
+        self.newest_sprints = {}
+        for sprint in sprints:
+            match = regex.match(sprint['name'])
+            if match is None:
+                continue
+            prefix = match.group('prefix').strip()
+            number = int(match.group('number'))
+            state = sprint['state'].lower()
+            if state == 'active':
+                self.current_sprints[prefix] = sprint
+            elif state == 'future' and \
+                    number < self.next_sprints.get(prefix, (number + 1,))[0]:
+                self.next_sprints[prefix] = (number, sprint)
+            if number > self.newest_sprints.get(prefix, (-1,))[0]:
+                self.newest_sprints[prefix] = (number, sprint)
+
+    def current(self, prefix):
+        """The active sprint of prefix, the last one listed if several are"""
+        if prefix not in self.current_sprints:
+            raise LookupError("No active sprint called %s" % prefix)
+        return self.current_sprints[prefix]
+
+    def next(self, prefix):
+        """The future sprint of prefix with the lowest number"""
+        if prefix not in self.next_sprints:
+            raise LookupError("No future sprint called %s" % prefix)
+        return self.next_sprints[prefix][1]
+
+    def newest_number(self, prefix):
+        """The highest sprint number of prefix, in any state"""
+        if prefix not in self.newest_sprints:
+            raise LookupError("No sprint called %s" % prefix)
+        return self.newest_sprints[prefix][0]
+
+    def new_sprint_name(self, prefix):
+        """Name of the sprint after the newest one of prefix, the newest
+           sprint's name with the number counted up"""
+        number = self.newest_number(prefix)
+        name = self.newest_sprints[prefix][1]['name']
+        start, end = self.regex.match(name).span('number')
+        return name[:start] + str(number + 1) + name[end:]
+
+    def in_state(self, state):
+        """Every listed sprint in state, e.g. closed, in listing order"""
+        return [sprint for sprint in self.sprints
+                if sprint['state'].lower() == state]
+
+
+def load_sprint_index(jira_instance, board_id, cache_file=None,
+                      ttl=DEFAULT_SPRINT_TTL, pattern=DEFAULT_SPRINT_PATTERN,
+                      engine=None):
+    """Index of the board's sprints, from cache_file if it was listed less
+       than ttl seconds ago, else listed from Jira and stored there"""
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as file_:
+            cached = json.load(file_)
+        if cached['fetched_at'] >= time.time() - ttl:
+            return SprintIndex(cached['sprints'], pattern)
+    sprints = list_sprints(jira_instance, board_id, engine=engine)
+    if cache_file:
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(cache_file, 'w') as file_:
+            json.dump({'fetched_at': time.time(), 'sprints': sprints}, file_)
+    return SprintIndex(sprints, pattern)
+
+
+def forget_sprint_index(cache_file):
+    """Drops a cached listing that no longer matches the board"""
+    if cache_file and os.path.exists(cache_file):
+        os.remove(cache_file)
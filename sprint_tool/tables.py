@@ -0,0 +1,13 @@
+"""
+Plain text tables for the summaries the commands print.
+"""
+
+
+def text_table(rows):
+    """Formats rows of strings, the first one the header, as columns padded
+       to their widest value and separated by two spaces"""
+    widths = [max(len(row[column]) for row in rows)
+              for column in range(len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width)
+                               for value, width in zip(row, widths)).rstrip()
+                     for row in rows)
@@ -0,0 +1,92 @@
+"""
+HTTP transport settings shared by every command: connection pooling,
+timeouts and retries with backoff for the Jira client's session.
+"""
+import random
+
+from sprint_tool import profiling
+
+# Number of hosts to keep connection pools for.
+DEFAULT_POOL_SIZE = 10
+
+# Connections kept open per host, enough for the worker pools to never wait
+# on a free connection.
+DEFAULT_MAX_CONNECTIONS = 32
+
+# Seconds to wait for a connection or a response.
+DEFAULT_TIMEOUT = 60
+
+DEFAULT_HTTP_RETRIES = 5
+
+# Seconds to back off before the first retry, doubled for every retry after.
+DEFAULT_BACKOFF = 0.5
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+_jitter_retry = None
+
+
+def jitter_retry_class():
+    """urllib3's Retry with the exponential backoff spread out randomly, so
+       parallel requests throttled together don't all come back at the same
+       time. A Retry-After header from the server is honored as is. Built on
+       first use so that urllib3 is only imported when connecting"""
+    global _jitter_retry
+    if _jitter_retry is None:
+        from urllib3.util.retry import Retry
+
+        class JitterRetry(Retry):
+            def get_backoff_time(self):
+                return super(JitterRetry, self).get_backoff_time() * \
+                    random.uniform(0.5, 1.5)
+
+        _jitter_retry = JitterRetry
+    return _jitter_retry
+
+
+def configure_session(session, pool_size=DEFAULT_POOL_SIZE,
+                      max_connections=DEFAULT_MAX_CONNECTIONS,
+                      retries=DEFAULT_HTTP_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Mounts a pooled, retrying adapter on a requests session. Only
+       idempotent requests are retried here, writes are retried where it is
+       known to be safe by the callers"""
+    from requests.adapters import HTTPAdapter
+    retry = jitter_retry_class()(total=retries,
+                                 backoff_factor=backoff,
+                                 status_forcelist=RETRY_STATUSES,
+                                 respect_retry_after_header=True,
+                                 raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=max_connections,
+                          max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                            'Connection': 'keep-alive'})
+    return session
+
+
+def create_jira_client(server, user, password, pool_size=DEFAULT_POOL_SIZE,
+                       max_connections=DEFAULT_MAX_CONNECTIONS,
+                       timeout=DEFAULT_TIMEOUT, retries=DEFAULT_HTTP_RETRIES,
+                       backoff=DEFAULT_BACKOFF):
+    """Connects to Jira with a session configured by configure_session()"""
+    from jira import JIRA
+    import urllib3
+    # certificates aren't verified, don't warn about it on every request
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    options = {
+        'server': server,
+        'agile_rest_path': 'agile',
+        'verify': False
+    }
+    # the client's own retry loop is turned off, the adapter retries instead
+    jira_instance = JIRA(options,
+                         auth=(user, password),
+                         timeout=timeout,
+                         max_retries=0)
+    configure_session(jira_instance._session, pool_size, max_connections,
+                      retries, backoff)
+    profiling.get_profiler().hook_session(jira_instance._session)
+    return jira_instance